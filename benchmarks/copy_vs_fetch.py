@@ -0,0 +1,61 @@
+"""
+Compares the tuple-based fetch path against COPY into pandas for 10k, 100k and 1M rows.
+
+The rows are generated server-side with the same column shape as account_details, so the
+benchmark runs against any database: python -m benchmarks.copy_vs_fetch
+"""
+import sys
+import time
+
+import pandas as pd
+
+from database.copy_fetch import copy_query
+from database.streaming import StreamBudget
+from utils import get_db_connection
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+BENCHMARK_SQL = """
+    SELECT
+        g AS id,
+        g %% 500 AS company_id,
+        g %% 40 AS period_id,
+        lpad((g %% 700000)::text, 6, '0') AS account_nr,
+        round((random() * 100000)::numeric, 2) AS value,
+        DATE '2020-01-01' + (g %% 1461) AS end_date
+    FROM generate_series(1, %(rows)s) AS g
+"""
+
+
+def fetch_tuples(conn, rows: int) -> pd.DataFrame:
+    with conn.cursor() as cursor:
+        cursor.execute(BENCHMARK_SQL, {"rows": rows})
+        return pd.DataFrame(cursor.fetchall(), columns=[x[0] for x in cursor.description])
+
+
+def fetch_copy(conn, rows: int) -> pd.DataFrame:
+    budget = StreamBudget(max_rows=rows, max_bytes=sys.maxsize)
+    return copy_query(conn, BENCHMARK_SQL, {"rows": rows}, budget=budget).frame
+
+
+def timed(fetch, conn, rows: int) -> tuple[float, int]:
+    start = time.perf_counter()
+    frame = fetch(conn, rows)
+    elapsed = time.perf_counter() - start
+    return elapsed, int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def main(sizes=SIZES):
+    print(f"{'rows':>10} {'tuples (s)':>12} {'copy (s)':>10} {'speedup':>8} {'tuples MB':>10} {'copy MB':>8}")
+    with get_db_connection(read_only=True) as conn:
+        for rows in sizes:
+            tuple_time, tuple_bytes = timed(fetch_tuples, conn, rows)
+            copy_time, copy_bytes = timed(fetch_copy, conn, rows)
+            print(
+                f"{rows:>10} {tuple_time:>12.2f} {copy_time:>10.2f} {tuple_time / copy_time:>7.1f}x"
+                f" {tuple_bytes / 2**20:>10.1f} {copy_bytes / 2**20:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,154 @@
+"""
+End-to-end latency benchmark of the calculator queries against a (synthetic) database.
+
+Runs every metric query behind bereken_*, bereken_alles, the vergelijk_op_basis_van rankings
+(live and, if built, from the metric cube), voorafbetaling and period resolution for random
+companies and fiscal years, and reports p50/p95 per case. Results are saved per git commit so
+runs can be compared:
+
+    python -m benchmarks.suite --dsn postgresql://localhost/kc_bench --iterations 50
+    python -m benchmarks.suite --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+
+import psycopg2
+
+from bot_queries.queries import voorafbetaling
+from calculator.metric_cube import cube_covers_fiscal_year, cube_ranking_sql
+from calculator.metrics import METRICS, company_metrics_sql, ranking_sql
+from database.fiscal_periods import clear_period_cache, resolve_period
+from database.pool import PooledPgConnection
+from database.statements import Statement, execute
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+ALLE_METRIEKEN = Statement("alle_metrieken", company_metrics_sql())
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def timed(cursor, sql, params=None) -> float:
+    start = time.perf_counter()
+    if isinstance(sql, Statement):
+        execute(cursor, sql, params)
+    else:
+        cursor.execute(sql, params)
+    cursor.fetchall()
+    return time.perf_counter() - start
+
+
+def cases(cursor, rng: random.Random):
+    """Yields (case name, zero-argument function returning its duration) pairs."""
+    cursor.execute("SELECT min(company_id), max(company_id), min(fiscal_year), max(fiscal_year) FROM fiscal_periods")
+    first_company, last_company, first_year, last_year = cursor.fetchone()
+
+    def company_period() -> dict:
+        for _ in range(100):
+            company_id = rng.randint(first_company, last_company)
+            period = resolve_period(cursor, company_id, rng.randint(first_year, last_year))
+            if period is not None:
+                return {"company_id": company_id, "period_id": period[0]}
+        raise RuntimeError("Geen periodes gevonden; genereer eerst data met benchmarks.synthetic_data")
+
+    for name in METRICS:
+        sql = company_metrics_sql([name])
+        yield f"bereken {name}", lambda sql=sql: timed(cursor, sql, company_period())
+    yield "bereken_alles", lambda: timed(cursor, ALLE_METRIEKEN, company_period())
+
+    use_cube = {year: cube_covers_fiscal_year(cursor, year) for year in range(first_year, last_year + 1)}
+    for name in METRICS:
+        for order_by in ("DESC", "ASC"):
+            live = Statement.from_sql("ranking", ranking_sql(name, order_by))
+            yield f"vergelijk {name} {order_by}", lambda live=live: timed(
+                cursor, live, {"fiscal_year": rng.randint(first_year, last_year), "limit": 10}
+            )
+            if any(use_cube.values()):
+                cube = Statement.from_sql("ranking", cube_ranking_sql(name, order_by))
+                yield f"vergelijk {name} {order_by} (cube)", lambda cube=cube: timed(
+                    cursor, cube, {"fiscal_year": rng.choice([y for y, ok in use_cube.items() if ok]), "limit": 10}
+                )
+
+    for term in range(5):
+        yield f"voorafbetaling term {term}", lambda term=term: timed(
+            cursor, voorafbetaling(term, rng.randint(first_year, last_year))
+        )
+
+    def resolve_uncached() -> float:
+        clear_period_cache()
+        start = time.perf_counter()
+        company_period()
+        return time.perf_counter() - start
+
+    yield "resolve_period", resolve_uncached
+
+
+def run(dsn: str, iterations: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    results = {}
+    with psycopg2.connect(dsn, connection_factory=PooledPgConnection) as conn:
+        with conn.cursor() as cursor:
+            for name, case in cases(cursor, rng):
+                case()  # warm-up: prepares statements and loads the pages once
+                durations = [case() for _ in range(iterations)]
+                results[name] = {
+                    "p50_ms": percentile(durations, 0.5) * 1000,
+                    "p95_ms": percentile(durations, 0.95) * 1000,
+                    "mean_ms": statistics.fmean(durations) * 1000,
+                    "iterations": iterations,
+                }
+                print(f"{name:<50} p50 {results[name]['p50_ms']:>9.2f} ms   p95 {results[name]['p95_ms']:>9.2f} ms")
+            conn.rollback()
+    return results
+
+
+def save(results: dict) -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w") as file:
+        json.dump({"commit": commit, "results": results}, file, indent=2)
+    return path
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f"{old['commit']} -> {new['commit']}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:<50} p50 {result['p50_ms']:>9.2f} ms   (nieuw)")
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+        print(
+            f"{name:<50} p50 {before['p50_ms']:>9.2f} -> {result['p50_ms']:>9.2f} ms ({change:+6.1f}%)   "
+            f"p95 {before['p95_ms']:>9.2f} -> {result['p95_ms']:>9.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dsn", help="benchmark database, e.g. postgresql://localhost/kc_bench")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    elif args.dsn:
+        print(f"Resultaten opgeslagen in {save(run(args.dsn, args.iterations, args.seed))}")
+    else:
+        parser.error("geef --dsn of --compare op")
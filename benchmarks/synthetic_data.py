@@ -0,0 +1,193 @@
+"""
+Generates a synthetic Silverfin-shaped dataset in a local Postgres for benchmarking.
+
+Every company gets a fiscal year end in December, March, June or September, one closing period
+and one interim period per fiscal year, `--accounts` PCMN accounts per closing period and a
+reconciliation result with tax rate and prepayments. All rows are generated server-side with
+generate_series, so 10k companies x 10 years x 400 accounts loads without going through Python.
+
+    python -m benchmarks.synthetic_data --dsn postgresql://localhost/kc_bench \
+        --companies 10000 --years 10 --accounts 400
+
+The target database is dropped and refilled; never point --dsn at RDS.
+"""
+import argparse
+import time
+
+import psycopg2
+
+from calculator.metric_cube import refresh_metric_cube
+from database.account_class import ensure_account_class_index
+from database.fiscal_periods import refresh_fiscal_periods
+
+SCHEMA_SQL = """
+    DROP TABLE IF EXISTS reconciliation_results, reconciliations, account_details, periods, companies CASCADE;
+    DROP TABLE IF EXISTS fiscal_periods, metric_cube, metric_cube_dirty CASCADE;
+
+    CREATE TABLE companies (
+        company_id bigint PRIMARY KEY,
+        name text NOT NULL
+    );
+    CREATE TABLE periods (
+        period_id bigint PRIMARY KEY,
+        company_id bigint NOT NULL REFERENCES companies,
+        start_date date NOT NULL,
+        end_date date NOT NULL,
+        fiscal_year_end date NOT NULL
+    );
+    CREATE TABLE account_details (
+        account_id bigserial PRIMARY KEY,
+        company_id bigint NOT NULL,
+        period_id bigint NOT NULL,
+        account_name text,
+        account_number text NOT NULL,
+        number_without_suffix text,
+        original_name text,
+        original_number text,
+        account_type text NOT NULL,
+        reconciliation_template_id bigint,
+        value numeric(18, 2) NOT NULL,
+        starred boolean NOT NULL DEFAULT false
+    );
+    CREATE TABLE reconciliations (
+        reconciliation_id bigserial PRIMARY KEY,
+        company_id bigint NOT NULL,
+        period_id bigint NOT NULL,
+        name text NOT NULL
+    );
+    CREATE TABLE reconciliation_results (
+        company_id bigint NOT NULL,
+        period_id bigint NOT NULL,
+        tax_percentage numeric(5, 2),
+        prep1_made numeric(18, 2),
+        prep2_made numeric(18, 2),
+        prep3_made numeric(18, 2),
+        prep4_made numeric(18, 2),
+        PRIMARY KEY (company_id, period_id)
+    );
+"""
+
+COMPANIES_SQL = """
+    INSERT INTO companies (company_id, name)
+    SELECT g, initcap((ARRAY['bakkerij', 'garage', 'bouw', 'consult', 'transport', 'apotheek', 'immo', 'brouwerij'])[1 + g %% 8])
+              || ' ' || (ARRAY['Janssens', 'Peeters', 'Maes', 'Jacobs', 'Mertens', 'Willems', 'Claes', 'Goossens'])[1 + (g / 8) %% 8]
+              || ' ' || (ARRAY['BV', 'NV', 'CommV', 'VOF'])[1 + (g / 64) %% 4] || ' ' || g
+    FROM generate_series(1, %(companies)s) AS g
+"""
+
+# Fiscal years end on the last day of December, March, June or September depending on the company.
+# Period ids: 2 * (company * years + year) is the closing period, + 1 the interim half-year.
+PERIODS_SQL = """
+    INSERT INTO periods (period_id, company_id, start_date, end_date, fiscal_year_end)
+    SELECT 2 * ((c - 1) * %(years)s + y) + interim,
+           c,
+           fye - interval '1 year' + interval '1 day',
+           CASE WHEN interim = 1 THEN (fye - interval '6 months')::date ELSE fye END,
+           fye
+    FROM generate_series(1, %(companies)s) AS c,
+         generate_series(0, %(years)s - 1) AS y,
+         generate_series(0, 1) AS interim,
+         LATERAL (
+             SELECT (make_date(%(first_year)s + y, (ARRAY[12, 3, 6, 9])[1 + c %% 4], 1)
+                     + interval '1 month' - interval '1 day')::date AS fye
+         ) AS f
+"""
+
+# A fixed chart of `accounts` PCMN numbers spread over the classes the calculator uses.
+CHART_SQL = """
+    CREATE TEMP TABLE chart ON COMMIT DROP AS
+    SELECT n,
+           klasse::text || lpad((n / 58)::text, 4, '0') AS account_number,
+           CASE
+               WHEN klasse BETWEEN 10 AND 19 OR klasse BETWEEN 42 AND 49 THEN 'liability'
+               WHEN klasse BETWEEN 60 AND 69 THEN 'expense'
+               WHEN klasse BETWEEN 70 AND 79 THEN 'income'
+               ELSE 'asset'
+           END AS account_type
+    FROM generate_series(0, %(accounts)s - 1) AS n,
+         LATERAL (
+             SELECT (ARRAY[10, 13, 14, 16, 17, 22, 24, 30, 34, 40, 41, 42, 43, 44, 45, 49, 50, 55, 57,
+                           60, 61, 62, 63, 64, 65, 66, 67, 68, 70, 71, 72, 74, 75, 76, 77, 78,
+                           11, 12, 15, 20, 21, 23, 25, 26, 27, 28, 29, 31, 32, 33, 35, 36, 37,
+                           46, 47, 48, 51, 52])[1 + n %% 58] AS klasse
+         ) AS k
+"""
+
+# Debit balances (assets, expenses) are positive, credit balances (liabilities, income) negative.
+ACCOUNT_DETAILS_SQL = """
+    INSERT INTO account_details (company_id, period_id, account_name, account_number, number_without_suffix,
+                                 original_name, original_number, account_type, value)
+    SELECT p.company_id, p.period_id,
+           'Rekening ' || ch.account_number, ch.account_number, ch.account_number,
+           'Rekening ' || ch.account_number, ch.account_number, ch.account_type,
+           round((CASE WHEN ch.account_type IN ('asset', 'expense') THEN 1 ELSE -1 END
+                  * exp(random() * 12))::numeric, 2)
+    FROM periods p
+    CROSS JOIN chart ch
+    WHERE p.period_id %% 2 = 0
+"""
+
+RECONCILIATIONS_SQL = """
+    INSERT INTO reconciliations (company_id, period_id, name)
+    SELECT p.company_id, p.period_id, r.name
+    FROM periods p
+    CROSS JOIN (VALUES ('Vennootschapsbelasting'), ('Voorafbetalingen'), ('BTW-aangifte')) AS r(name)
+    WHERE p.period_id %% 2 = 0;
+
+    INSERT INTO reconciliation_results (company_id, period_id, tax_percentage,
+                                        prep1_made, prep2_made, prep3_made, prep4_made)
+    SELECT company_id, period_id,
+           CASE WHEN random() < 0.7 THEN 20.00 ELSE 25.00 END,
+           round((random() * 50000)::numeric, 2), round((random() * 50000)::numeric, 2),
+           round((random() * 50000)::numeric, 2), round((random() * 50000)::numeric, 2)
+    FROM periods
+    WHERE period_id %% 2 = 0;
+"""
+
+INDEXES_SQL = """
+    CREATE INDEX ON periods (company_id, end_date);
+    CREATE INDEX ON account_details (company_id, period_id);
+    CREATE INDEX ON account_details (period_id);
+    CREATE INDEX ON reconciliations (company_id, period_id);
+"""
+
+
+def generate(dsn: str, companies: int, years: int, accounts: int, first_year: int, cube: bool):
+    params = {"companies": companies, "years": years, "accounts": accounts, "first_year": first_year}
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT setseed(0.42)")
+            for label, sql in (
+                ("schema", SCHEMA_SQL),
+                ("companies", COMPANIES_SQL),
+                ("periods", PERIODS_SQL),
+                ("chart", CHART_SQL),
+                ("account_details", ACCOUNT_DETAILS_SQL),
+                ("reconciliations", RECONCILIATIONS_SQL),
+                ("indexes", INDEXES_SQL),
+            ):
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                print(f"{label:<20} {time.perf_counter() - start:>8.1f}s")
+
+            start = time.perf_counter()
+            refresh_fiscal_periods(cursor)
+            ensure_account_class_index(cursor)
+            print(f"{'fiscal_periods/index':<20} {time.perf_counter() - start:>8.1f}s")
+            if cube:
+                start = time.perf_counter()
+                refresh_metric_cube(cursor, full=True)
+                print(f"{'metric_cube':<20} {time.perf_counter() - start:>8.1f}s")
+            cursor.execute("ANALYZE")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dsn", required=True, help="local benchmark database, e.g. postgresql://localhost/kc_bench")
+    parser.add_argument("--companies", type=int, default=1_000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--accounts", type=int, default=400)
+    parser.add_argument("--first-year", type=int, default=2015)
+    parser.add_argument("--cube", action="store_true", help="also build the metric cube")
+    args = parser.parse_args()
+    generate(args.dsn, args.companies, args.years, args.accounts, args.first_year, args.cube)
@@ -68,6 +68,15 @@ from datetime import datetime
 #     return query
 
 
+PREPAYMENT_COLUMNS = {
+    0: "prep1_made, prep2_made, prep3_made, prep4_made",
+    1: "prep1_made",
+    2: "prep2_made",
+    3: "prep3_made",
+    4: "prep4_made",
+}
+
+
 def voorafbetaling(term:int, year:int) -> str:
     """
     Returns an SQL query to retrieve the prepayments (voorafbetalingen) for a specific term (quarter) for all dossiers/companies.
@@ -88,24 +97,17 @@ def voorafbetaling(term:int, year:int) -> str:
     Errors:
         ValueError: If the input parameters are invalid.
     """
-    # Validate date
-    
+    # Both values are inlined into the SQL, so only accept what converts to a known int.
+    try:
+        year = int(year)
+        term = int(term)
+    except (TypeError, ValueError):
+        raise ValueError("Term and year must be whole numbers (e.g., term 1, year 2023)")
     if not (2000 <= year <= 2099):
         raise ValueError("Year must be in the form 20.. (e.g., 2023)")
-    # Validate limit
-    if not(term == 0 or term == 1 or term == 2 or term == 3 or term == 4):
-        raise ValueError("Term must be 1,2,3 or 4")
-    else:
-        if term == 0:
-            quart = "prep1_made, prep2_made, prep3_made, prep4_made"
-        if term == 1:
-            quart = "prep1_made"
-        if term == 2:
-            quart = "prep2_made"
-        if term == 3:
-            quart = "prep3_made"
-        if term == 4:
-            quart = "prep4_made"
+    if term not in PREPAYMENT_COLUMNS:
+        raise ValueError("Term must be 0, 1, 2, 3 or 4")
+    quart = PREPAYMENT_COLUMNS[term]
 
     query = f"""
             WITH LatestEntries AS (
@@ -1,5 +1,6 @@
 from .calculations import (
     bereken_afschrijvingen,
+    bereken_alles,
     bereken_balanstotaal,
     bereken_bruto_marge,
     bereken_dso,
@@ -13,13 +14,27 @@ from .calculations import (
     bereken_liquide_middelen,
     bereken_netto_financiele_schuld,
     bereken_omzet,
+    bereken_resultaat,
     bereken_VERLIES,
     bereken_voorzieningen,
 )
-from utils import get_db_connection
+from .metric_cube import cube_covers_fiscal_year, cube_ranking_sql
+from .metrics import METRICS, grouped_metrics_sql, ranking_sql
+from database.statements import Statement, execute
+from database.streaming import StreamResult, _frame_bytes
+from utils import (
+    PREVIEW_BERICHT,
+    get_db_connection,
+    get_fresh_snapshot,
+    get_result_cache,
+    get_slow_query_log,
+    load_data_preview,
+    snapshot_notice,
+)
 from django.utils import timezone
 import streamlit as st
 import pandas as pd
+import time
 calculations = {
     "EBITDA": bereken_EBITDA,
     "verlies": bereken_VERLIES,
@@ -39,7 +54,7 @@ calculations = {
     "dso": bereken_dso,
 }
 
-def load_data(sql_query: str):
+def load_data(sql_query: str | Statement, params: dict | None = None):
     """
     Voert een SQL-query uit en retourneert het resultaat. Het resultaat kan groter zijn dan jouw context window dus krijg jij een preview van de data terwijl de volledige data naast jouw antwoord wordt getoond in een pandas dataframe. Je hoeft je resultaat niet te tonen, enkel herkennen dat de functie succesvol. Jij krijgt een preview zodat als er vragen zijn jij die veranderen kan doorvoeren.
     Args:
@@ -48,35 +63,64 @@ def load_data(sql_query: str):
         
     Opmerking:
         Gebruik eerst de functies list_tables en describe_tables voor context.
+    Foutafhandeling:
+        Geeft een foutbericht terug als de query te duur is volgens de planner of te lang duurt. Herschrijf de query dan goedkoper.
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(sql_query)
-            result = cursor.fetchall()
-            full_df = pd.DataFrame(result)
-            st.session_state.data = full_df
-            st.session_state.data.columns =[ x[0] for x in cursor.description ]
-            return "Het volgende is een preview van data, de user krijgt de hele data te zien. Jij, de chatbot krijgt een deel omdat er anders het risico is om jou context window te overflowen. Vermeld in je antwoord dat jij een preview hebt van de data en de volledige data rechts van de chat te vinden is!" +  str(full_df.head(1))
-
-def bereken(what: str, company_id: int, date: str):
+    if isinstance(sql_query, Statement):
+        # Prepared statements can't back a server-side cursor; they only serve bounded rankings.
+        cache = get_result_cache()
+        result = cache.get(sql_query.sql, params)
+        if result is None:
+            start = time.perf_counter()
+            with get_db_connection(read_only=True) as conn:
+                with conn.cursor() as cursor:
+                    execute(cursor, sql_query, params)
+                    full_df = pd.DataFrame(
+                        cursor.fetchall(), columns=[x[0] for x in cursor.description]
+                    )
+            result = StreamResult(
+                frame=full_df,
+                rows=len(full_df),
+                bytes=_frame_bytes(full_df),
+                truncated=False,
+                preview=full_df.head(5),
+            )
+            get_slow_query_log().observe(
+                sql_query.sql, params, time.perf_counter() - start, "vergelijk_op_basis_van"
+            )
+            cache.put(sql_query.sql, params, result)
+        st.session_state.data = result.frame
+        return PREVIEW_BERICHT + str(result.frame.head(1))
+
+    return load_data_preview(sql_query, params)
+
+def bereken(what: str, company_id: int, date: str, modus: str = "waarde"):
     """
-    Voert een specifieke berekening uit voor een bedrijf in een bepaalde periode.
+    Voert een specifieke berekening uit voor een bedrijf in een bepaalde periode en geeft het getal terug.
     Args:
         what (str): Het type berekening (EBITDA, verlies, balanstotaal, eigen vermogen, voorzieningen, handelswerkkapitaal, financiele schulden, liquide middelen, bruto marge, omzet, EBITDA marge, afschrijvingen, netto financiele schuld, handelsvorderingen, dso)
         company_id (int): De ID van het bedrijf. Gebruik de period_tool om de ID te verkrijgen als je alleen de bedrijfsnaam hebt.
         date (str): Einddatum van de periode in "YYYY-MM-DD" formaat.
+        modus (str): "waarde" (standaard) voert de berekening meteen uit. Gebruik "sql" enkel als de gebruiker de SQL-query wil zien of aanpassen; voer die dan uit met de load_data tool.
     Returns:
-        float: Het resultaat van de berekening.
+        MetricResult: De waarde (value), de gebruikte periode (period_id), de munteenheid (currency) en de deelresultaten (components) van de berekening.
     Foutafhandeling:
         Geeft een foutbericht als het gevraagde type berekening niet wordt ondersteund.
     """
 
     # TODO: Vergelijk mogelijke synoniemen/typefouten met sleutelwoorden in calculations (gebruik cosine similarity of LLM).
 
-    if what in calculations:
+    if what not in calculations:
+        return f"Kan de berekening voor '{what}' niet uitvoeren. Alleen de volgende berekeningen worden ondersteund: {list(calculations.keys())}"
+
+    if modus == "sql":
         return calculations[what](company_id, date)
+    if modus != "waarde":
+        return "modus moet 'waarde' of 'sql' zijn."
 
-    return f"Kan de berekening voor '{what}' niet uitvoeren. Alleen de volgende berekeningen worden ondersteund: {list(calculations.keys())}"
+    # All metrics come out of one aggregation pass, so follow-up questions about the
+    # same company and period are served from bereken_alles' cache.
+    return bereken_resultaat(what, company_id, date)
 
 
 def vergelijk_op_basis_van(
@@ -93,491 +137,103 @@ def vergelijk_op_basis_van(
         return (
             "Dit is een te groot aantal bedrijven. Kies aub een kleinere hoeveelheid."
         )
-    match what:
-        case "EBITDA":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                            ROW_NUMBER() OVER (
-                                                PARTITION BY company_id 
-                                                ORDER BY 
-                                                    (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                                    end_date DESC
-                                            ) AS rn
-                                        FROM periods
-                                        WHERE DATE_PART('year', end_date) = {date.year}
-                                    )
-
-                                    SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                                    FROM companies c
-                                    JOIN account_details ad ON c.company_id = ad.company_id
-                                    JOIN periods p ON ad.period_id = p.period_id
-                                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                                    WHERE ad.account_number SIMILAR TO '60%|61%|62%|64%|70%|71%|72%|73%|74%'
-                                    GROUP BY c.company_id, c.name
-                                    ORDER BY total_value {order_by}
-                                    LIMIT {limit};
-                                    """
-        case "verlies":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '60%|61%|62%|63%|64%|65%|66%|67%|68%|70%|71%|72%|73%|74%|75%|76%|77%|78%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "balanstotaal":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '60%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "eigen vermogen":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '10%|11%|12%|13%|14%|15%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "voorziening":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '16%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "handelswerkkapitaal":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT 
-                            c.company_id, 
-                            c.name, 
-                            SUM(CASE WHEN ad.account_number SIMILAR TO '30%|31%|32%|33%|34%|35%|36%|37%|40' 
-                                    THEN ad.value 
-                                    ELSE 0 
-                                END) 
-                            - SUM(CASE WHEN ad.account_number LIKE '44%' 
-                                    THEN ad.value 
-                                    ELSE 0 
-                                END) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "financiele schulden":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '16%|17%|42%|43%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "liquide middelen":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '50%|51%|52%|53%|54%|55%|56%|57%|58%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "bruto marge":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT 
-                            c.company_id, 
-                            c.name, 
-                            SUM(CASE WHEN ad.account_number SIMILAR TO '70%|71%|72%|74%' 
-                                    THEN ad.value 
-                                    ELSE 0 
-                                END) 
-                            - SUM(CASE WHEN ad.account_number LIKE '60%' 
-                                    THEN ad.value 
-                                    ELSE 0 
-                                END) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "omzet":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '70%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "EBITDA marge":
-            sql = f"""WITH latest_period AS (
-                    SELECT period_id, company_id,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY company_id 
-                            ORDER BY 
-                                (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                end_date DESC
-                        ) AS rn
-                    FROM periods
-                    WHERE DATE_PART('year', end_date) = {date.year}
-                ),
-
-                -- Bereken de EBITDA voor elk bedrijf
-                ebitda AS (
-                    SELECT c.company_id, c.name, SUM(ad.value) AS ebitda_value
-                    FROM companies c
-                    JOIN account_details ad ON c.company_id = ad.company_id
-                    JOIN periods p ON ad.period_id = p.period_id
-                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                    WHERE ad.account_number SIMILAR TO '60%|61%|62%|64%|70%|71%|72%|73%|74%'
-                    GROUP BY c.company_id, c.name
-                ),
-
-                -- Bereken de omzet voor elk bedrijf
-                marge AS (
-                    SELECT c.company_id, SUM(ad.value) AS marge_value
-                    FROM companies c
-                    JOIN account_details ad ON c.company_id = ad.company_id
-                    JOIN periods p ON ad.period_id = p.period_id
-                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                    WHERE ad.account_number SIMILAR TO '70%'
-                    GROUP BY c.company_id
-                )
-
-                -- Combineer EBITDA en marge om de EBITDA-marge te berekenen
-                SELECT e.company_id, 
-                    e.name, 
-                    e.ebitda_value, 
-                    m.marge_value, 
-                    CASE 
-                        WHEN m.marge_value <> 0 THEN e.ebitda_value / m.marge_value
-                        ELSE NULL 
-                    END AS ebitda_marge
-                FROM ebitda e
-                JOIN marge m ON e.company_id = m.company_id
-                ORDER BY ebitda_marge {order_by}
-                LIMIT {limit};
-                """
-        case "afschrijvingen":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        )
-
-                        SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                        FROM companies c
-                        JOIN account_details ad ON c.company_id = ad.company_id
-                        JOIN periods p ON ad.period_id = p.period_id
-                        JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                        WHERE ad.account_number SIMILAR TO '63%'
-                        GROUP BY c.company_id, c.name
-                        ORDER BY total_value {order_by}
-                        LIMIT {limit};
-                        """
-        case "EBIT":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        ),
-
-                        -- CTE to calculate the total_value for account numbers starting with '60%|61%|62%|64%|70%|71%|72%|73%|74%'
-                        value_main AS (
-                            SELECT c.company_id, c.name, SUM(ad.value) AS total_value_main
-                            FROM companies c
-                            JOIN account_details ad ON c.company_id = ad.company_id
-                            JOIN periods p ON ad.period_id = p.period_id
-                            JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                            WHERE ad.account_number SIMILAR TO '60%|61%|62%|64%|70%|71%|72%|73%|74%'
-                            GROUP BY c.company_id, c.name
-                        ),
-
-                        -- CTE to calculate the total_value for account numbers starting with '63%'
-                        value_63 AS (
-                            SELECT c.company_id, SUM(ad.value) AS total_value_63
-                            FROM companies c
-                            JOIN account_details ad ON c.company_id = ad.company_id
-                            JOIN periods p ON ad.period_id = p.period_id
-                            JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                            WHERE ad.account_number SIMILAR TO '63%'
-                            GROUP BY c.company_id
-                        )
-
-                        -- Main query to join the results and perform the subtraction
-                        SELECT v_main.company_id, 
-                            v_main.name, 
-                            v_main.total_value_main, 
-                            v_63.total_value_63,
-                            v_main.total_value_main - v_63.total_value_63 AS result_difference
-                        FROM value_main v_main
-                        JOIN value_63 v_63 ON v_main.company_id = v_63.company_id
-                        ORDER BY result_difference {order_by}
-                        LIMIT {limit};
-                        """
-        case "Netto financiele schuld":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                ROW_NUMBER() OVER (
-                                    PARTITION BY company_id 
-                                    ORDER BY 
-                                        (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                        end_date DESC
-                                ) AS rn
-                            FROM periods
-                            WHERE DATE_PART('year', end_date) = {date.year}
-                        ),
-
-                        -- CTE to calculate the total_value for account numbers starting with '16%|17%|42%|43%'
-                        value_1 AS (
-                            SELECT c.company_id, c.name, SUM(ad.value) AS total_value_1
-                            FROM companies c
-                            JOIN account_details ad ON c.company_id = ad.company_id
-                            JOIN periods p ON ad.period_id = p.period_id
-                            JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                            WHERE ad.account_number SIMILAR TO '16%|17%|42%|43%'
-                            GROUP BY c.company_id, c.name
-                        ),
-
-                        -- CTE to calculate the total_value for account numbers starting with '50%|51%|52%|53%|54%|55%|56%|57%|58%'
-                        value_2 AS (
-                            SELECT c.company_id, SUM(ad.value) AS total_value_2
-                            FROM companies c
-                            JOIN account_details ad ON c.company_id = ad.company_id
-                            JOIN periods p ON ad.period_id = p.period_id
-                            JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                            WHERE ad.account_number SIMILAR TO '50%|51%|52%|53%|54%|55%|56%|57%|58%'
-                            GROUP BY c.company_id
-                        )
-
-                        -- Main query to join the results and perform the subtraction
-                        SELECT v1.company_id, 
-                            v1.name, 
-                            v1.total_value_1, 
-                            v2.total_value_2,
-                            v1.total_value_1 - v2.total_value_2 AS result_difference
-                        FROM value_1 v1
-                        JOIN value_2 v2 ON v1.company_id = v2.company_id
-                        ORDER BY result_difference {order_by}
-                        LIMIT {limit};
-                        """
-        case "handelsvorderingen":
-            sql = f"""WITH latest_period AS (
-                            SELECT period_id, company_id,
-                                            ROW_NUMBER() OVER (
-                                                PARTITION BY company_id 
-                                                ORDER BY 
-                                                    (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                                    end_date DESC
-                                            ) AS rn
-                                        FROM periods
-                                        WHERE DATE_PART('year', end_date) = {date.year}
-                                    )
-
-                                    SELECT c.company_id, c.name, SUM(ad.value) AS total_value
-                                    FROM companies c
-                                    JOIN account_details ad ON c.company_id = ad.company_id
-                                    JOIN periods p ON ad.period_id = p.period_id
-                                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                                    WHERE ad.account_number SIMILAR TO '40%'
-                                    GROUP BY c.company_id, c.name
-                                    ORDER BY total_value {order_by}
-                                    LIMIT {limit};
-                                    """
-        case "dso":
-            sql = f"""WITH latest_period AS (
-                    SELECT period_id, company_id,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY company_id 
-                            ORDER BY 
-                                (CASE WHEN end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year} THEN 1 ELSE 2 END),
-                                end_date DESC
-                        ) AS rn
-                    FROM periods
-                    WHERE DATE_PART('year', end_date) = {date.year}
-                ),
-
-                -- First CTE to calculate the total_value for account numbers starting with '40%'
-                value_40 AS (
-                    SELECT c.company_id, c.name, SUM(ad.value) AS total_value_40
-                    FROM companies c
-                    JOIN account_details ad ON c.company_id = ad.company_id
-                    JOIN periods p ON ad.period_id = p.period_id
-                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                    WHERE ad.account_number SIMILAR TO '40%'
-                    GROUP BY c.company_id, c.name
-                ),
-
-                -- Second CTE to calculate the total_value for account numbers starting with '70%'
-                value_70 AS (
-                    SELECT c.company_id, SUM(ad.value) AS total_value_70
-                    FROM companies c
-                    JOIN account_details ad ON c.company_id = ad.company_id
-                    JOIN periods p ON ad.period_id = p.period_id
-                    JOIN latest_period lp ON lp.company_id = c.company_id AND ad.period_id = lp.period_id AND lp.rn = 1
-                    WHERE ad.account_number SIMILAR TO '70%'
-                    GROUP BY c.company_id
-                )
-
-                -- Main query to join the results and perform the division
-                SELECT v40.name, 
-                    CASE 
-                        WHEN v70.total_value_70 <> 0 THEN abs(v40.total_value_40 / v70.total_value_70) * 365
-                        ELSE NULL 
-                    END AS result_ratio
-                FROM value_40 v40
-                JOIN value_70 v70 ON v40.company_id = v70.company_id
-                WHERE v70.total_value_70 <> 0
-                ORDER BY result_ratio {order_by}
-                LIMIT {limit};
-                """
-
-    return load_data(sql)
-
+    if what not in METRICS:
+        return f"Kan niet vergelijken op basis van '{what}'. Alleen de volgende berekeningen worden ondersteund: {list(METRICS.keys())}"
+    if order_by.upper() not in ("ASC", "DESC"):
+        return "order_by moet 'ASC' of 'DESC' zijn."
+
+    params = {"fiscal_year": date.year, "limit": int(limit)}
+    # Fresh analytical snapshot first, then the metric cube, then a live scan of account_details.
+    snapshot = get_fresh_snapshot([date.year])
+    if snapshot is not None:
+        ranking = snapshot.query(ranking_sql(what, order_by, partitioned=True), params)
+        st.session_state.data = ranking
+        return PREVIEW_BERICHT + str(ranking.head(1)) + snapshot_notice(snapshot)
+
+    with get_db_connection(read_only=True) as conn:
+        with conn.cursor() as cursor:
+            use_cube = cube_covers_fiscal_year(cursor, date.year)
+    sql = cube_ranking_sql(what, order_by) if use_cube else ranking_sql(what, order_by)
+    statement = Statement.from_sql("ranking", sql)
+    return load_data(statement, params)
+
+
+def _batch_sql(whats: list[str], partitioned: bool = False) -> str:
+    # On the Parquet snapshot, account_details is partitioned on fiscal_year; filter on it so
+    # only the requested years are read.
+    partition = "\n            WHERE ad.fiscal_year = ANY(%(fiscal_years)s)" if partitioned else ""
+    metrics = grouped_metrics_sql(
+        f"""FROM perioden pp
+            JOIN account_details ad ON ad.company_id = pp.company_id AND ad.period_id = pp.period_id{partition}""",
+        whats,
+    )
+    columns = ", ".join(f'm."{what}"' for what in whats)
+    return f"""
+        WITH perioden AS (
+            SELECT company_id, fiscal_year, period_id
+            FROM fiscal_periods
+            WHERE company_id = ANY(%(company_ids)s) AND fiscal_year = ANY(%(fiscal_years)s)
+        )
+        SELECT p.company_id, c.name, p.fiscal_year, p.period_id, {columns}
+        FROM perioden p
+        JOIN companies c ON c.company_id = p.company_id
+        LEFT JOIN ({metrics}) AS m ON m.company_id = p.company_id AND m.period_id = p.period_id
+        ORDER BY p.company_id, p.fiscal_year;
+    """
 
 
+def bereken_many(whats: list[str], company_ids: list[int], dates: list[str]):
+    """
+    Berekent meerdere kengetallen voor meerdere bedrijven en periodes in een keer. Gebruik deze tool in plaats van bereken
+    wanneer de vraag over meer dan een bedrijf, kengetal of jaar gaat. De volledige tabel wordt naast de chat getoond.
+    Args:
+        whats (list[str]): De gevraagde berekeningen (EBITDA, verlies, balanstotaal, eigen vermogen, voorzieningen, handelswerkkapitaal, financiele schulden, liquide middelen, bruto marge, omzet, EBITDA marge, afschrijvingen, netto financiele schuld, handelsvorderingen, dso)
+        company_ids (list[int]): De IDs van de bedrijven.
+        dates (list[str]): Einddatums van de periodes in "YYYY-MM-DD" formaat, bijv. ["2021-12-31", "2022-12-31"].
+    Returns:
+        Een preview van de resultaten, met een rij per bedrijf, boekjaar en kengetal.
+    """
+    whats = list(dict.fromkeys(whats))
+    onbekend = [what for what in whats if what not in METRICS]
+    if onbekend:
+        return f"Kan de berekening voor {onbekend} niet uitvoeren. Alleen de volgende berekeningen worden ondersteund: {list(METRICS.keys())}"
+    if not whats or not company_ids or not dates:
+        return "Geef minstens een berekening, een bedrijf en een datum op."
+
+    company_ids = sorted({int(company_id) for company_id in company_ids})
+    fiscal_years = sorted({timezone.datetime.fromisoformat(date).year for date in dates})
+    params = {"company_ids": company_ids, "fiscal_years": fiscal_years}
+
+    snapshot = get_fresh_snapshot(fiscal_years)
+    if snapshot is not None:
+        wide = snapshot.query(_batch_sql(whats, partitioned=True), params)
+    else:
+        statement = Statement.from_sql("batch_metrics", _batch_sql(whats))
+        with get_db_connection(read_only=True) as conn:
+            with conn.cursor() as cursor:
+                execute(cursor, statement, params)
+                result = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+        wide = pd.DataFrame(result, columns=columns)
+    tidy = wide.melt(
+        id_vars=["company_id", "name", "fiscal_year", "period_id"],
+        value_vars=whats,
+        var_name="metric",
+        value_name="value",
+    )
+    tidy["value"] = pd.to_numeric(tidy["value"])
+    st.session_state.data = tidy
+
+    gevonden = set(zip(wide["company_id"], wide["fiscal_year"]))
+    ontbrekend = [
+        (company_id, fiscal_year)
+        for company_id in company_ids
+        for fiscal_year in fiscal_years
+        if (company_id, fiscal_year) not in gevonden
+    ]
+    bericht = PREVIEW_BERICHT + str(tidy.head(len(whats)))
+    if ontbrekend:
+        bericht += f"\nGeen periode gevonden voor (company_id, boekjaar): {ontbrekend}"
+    if snapshot is not None:
+        bericht += snapshot_notice(snapshot)
+    return bericht
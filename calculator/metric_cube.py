@@ -0,0 +1,209 @@
+from psycopg2._psycopg import cursor
+
+from .metrics import METRICS, grouped_metrics_sql
+from database.statements import Statement, execute
+
+# One row per (company_id, period_id, metric). account_details triggers queue every
+# period whose rows change in metric_cube_dirty, so a refresh only recomputes those.
+CREATE_METRIC_CUBE_SQL = """
+    CREATE TABLE IF NOT EXISTS metric_cube (
+        company_id bigint NOT NULL,
+        period_id bigint NOT NULL,
+        metric text NOT NULL,
+        value numeric,
+        refreshed_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (company_id, period_id, metric)
+    );
+
+    CREATE TABLE IF NOT EXISTS metric_cube_dirty (
+        company_id bigint NOT NULL,
+        period_id bigint NOT NULL,
+        PRIMARY KEY (company_id, period_id)
+    );
+
+    CREATE OR REPLACE FUNCTION metric_cube_mark_dirty() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO metric_cube_dirty (company_id, period_id)
+            SELECT DISTINCT company_id, period_id FROM new_rows
+            ON CONFLICT DO NOTHING;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO metric_cube_dirty (company_id, period_id)
+            SELECT DISTINCT company_id, period_id FROM old_rows
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+    $$;
+
+    DROP TRIGGER IF EXISTS account_details_cube_insert ON account_details;
+    CREATE TRIGGER account_details_cube_insert AFTER INSERT ON account_details
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION metric_cube_mark_dirty();
+
+    DROP TRIGGER IF EXISTS account_details_cube_update ON account_details;
+    CREATE TRIGGER account_details_cube_update AFTER UPDATE ON account_details
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION metric_cube_mark_dirty();
+
+    DROP TRIGGER IF EXISTS account_details_cube_delete ON account_details;
+    CREATE TRIGGER account_details_cube_delete AFTER DELETE ON account_details
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION metric_cube_mark_dirty();
+"""
+
+
+CUBE_AVAILABLE = Statement("cube_available", "SELECT to_regclass('metric_cube') IS NOT NULL")
+
+CUBE_METRICS = Statement(
+    "cube_metrics",
+    """
+    SELECT metric, value
+    FROM metric_cube
+    WHERE company_id = %(company_id)s AND period_id = %(period_id)s
+      AND NOT EXISTS (
+          SELECT 1 FROM metric_cube_dirty
+          WHERE company_id = %(company_id)s AND period_id = %(period_id)s
+      )
+    """,
+)
+
+CUBE_COVERS_FISCAL_YEAR = Statement(
+    "cube_covers_fiscal_year",
+    """
+    SELECT
+        EXISTS (
+            SELECT 1 FROM fiscal_periods fp
+            JOIN metric_cube mc ON mc.company_id = fp.company_id AND mc.period_id = fp.period_id
+            WHERE fp.fiscal_year = %(fiscal_year)s
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM fiscal_periods fp
+            JOIN metric_cube_dirty d ON d.company_id = fp.company_id AND d.period_id = fp.period_id
+            WHERE fp.fiscal_year = %(fiscal_year)s
+        )
+    """,
+)
+
+
+def _unpivot_sql(source: str) -> str:
+    values = ", ".join(
+        f"""('{name}', metrieken."{name}")""" for name in METRICS
+    )
+    return f"""
+        INSERT INTO metric_cube (company_id, period_id, metric, value)
+        SELECT metrieken.company_id, metrieken.period_id, v.metric, v.value
+        FROM ({grouped_metrics_sql(source)}) AS metrieken
+        CROSS JOIN LATERAL (VALUES {values}) AS v(metric, value);
+    """
+
+
+def ensure_metric_cube(cursor: cursor):
+    cursor.execute(CREATE_METRIC_CUBE_SQL)
+
+
+def refresh_metric_cube(cursor: cursor, full: bool = False) -> int:
+    """
+    Recomputes the cube for every period queued in metric_cube_dirty, or for all periods
+    when `full` is set. Returns the number of (company, period) pairs refreshed.
+    """
+    ensure_metric_cube(cursor)
+    if full:
+        cursor.execute("TRUNCATE metric_cube, metric_cube_dirty")
+        cursor.execute(_unpivot_sql("FROM account_details ad"))
+        return cursor.rowcount // len(METRICS)
+
+    cursor.execute("DROP TABLE IF EXISTS metric_cube_todo")
+    cursor.execute(
+        "CREATE TEMP TABLE metric_cube_todo (company_id bigint, period_id bigint) ON COMMIT DROP"
+    )
+    cursor.execute(
+        """
+        WITH dirty AS (DELETE FROM metric_cube_dirty RETURNING company_id, period_id)
+        INSERT INTO metric_cube_todo SELECT company_id, period_id FROM dirty
+        """
+    )
+    refreshed = cursor.rowcount
+    if refreshed == 0:
+        return 0
+    cursor.execute(
+        """
+        DELETE FROM metric_cube mc
+        USING metric_cube_todo t
+        WHERE mc.company_id = t.company_id AND mc.period_id = t.period_id
+        """
+    )
+    cursor.execute(
+        _unpivot_sql(
+            """FROM metric_cube_todo t
+            JOIN account_details ad ON ad.company_id = t.company_id AND ad.period_id = t.period_id"""
+        )
+    )
+    return refreshed
+
+
+def cube_is_available(cursor: cursor) -> bool:
+    execute(cursor, CUBE_AVAILABLE)
+    return cursor.fetchone()[0]
+
+
+def cube_metrics(cursor: cursor, company_id: int, period_id: int) -> dict | None:
+    """All metrics of one company/period from the cube, or None if missing or pending a refresh."""
+    if not cube_is_available(cursor):
+        return None
+    execute(cursor, CUBE_METRICS, {"company_id": company_id, "period_id": period_id})
+    rows = dict(cursor.fetchall())
+    if set(rows) != set(METRICS):
+        return None
+    return {
+        name: (float(rows[name]) if rows[name] is not None else None) for name in METRICS
+    }
+
+
+def cube_covers_fiscal_year(cursor: cursor, fiscal_year: int) -> bool:
+    """True when the cube holds the closing periods of `fiscal_year` and none of them is dirty."""
+    if not cube_is_available(cursor):
+        return False
+    execute(cursor, CUBE_COVERS_FISCAL_YEAR, {"fiscal_year": fiscal_year})
+    return cursor.fetchone()[0]
+
+
+def cube_ranking_sql(name: str, order_by: str = "DESC") -> str:
+    """
+    Cube counterpart of metrics.ranking_sql: same columns, read from metric_cube.
+    Parameters: %(fiscal_year)s, %(limit)s.
+    """
+    order_by = order_by.upper()
+    if order_by not in ("ASC", "DESC"):
+        raise ValueError("order_by must be 'ASC' or 'DESC'.")
+    names = [*METRICS[name].components, name]
+    columns = ",\n            ".join(
+        f"MAX(mc.value) FILTER (WHERE mc.metric = '{column}') AS \"{column}\"" for column in names
+    )
+    metric_list = ", ".join(f"'{column}'" for column in names)
+    return f"""
+        SELECT
+            c.company_id,
+            c.name,
+            {columns}
+        FROM fiscal_periods fp
+        JOIN metric_cube mc ON mc.company_id = fp.company_id AND mc.period_id = fp.period_id
+        JOIN companies c ON c.company_id = fp.company_id
+        WHERE fp.fiscal_year = %(fiscal_year)s AND mc.metric IN ({metric_list})
+        GROUP BY c.company_id, c.name
+        ORDER BY "{name}" {order_by} NULLS LAST
+        LIMIT %(limit)s;
+    """
+
+
+if __name__ == "__main__":
+    import sys
+
+    from utils import get_db_connection
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            refreshed = refresh_metric_cube(cursor, full="--full" in sys.argv)
+            print(f"{refreshed} periodes in de metric cube vernieuwd")
@@ -0,0 +1,256 @@
+from dataclasses import dataclass
+
+from enums.account_type import AccountType
+
+
+@dataclass(frozen=True)
+class Metric:
+    """
+    Declarative definition of a calculator metric.
+
+    A base metric sums `value` over the accounts whose number starts with one of `prefixes`
+    (or that have `account_type`), minus the sum over the `subtract` prefixes, times `sign`.
+    A derived metric is either a linear combination of other metrics (`terms`) or a ratio
+    (`numerator` / `denominator`). `absolute` and `scale` are applied last,
+    e.g. DSO = |handelsvorderingen / omzet| * 365.
+    """
+
+    name: str
+    prefixes: tuple[str, ...] = ()
+    subtract: tuple[str, ...] = ()
+    account_type: AccountType | None = None
+    sign: int = -1
+    terms: tuple[tuple[str, int], ...] = ()
+    numerator: str | None = None
+    denominator: str | None = None
+    absolute: bool = False
+    scale: int = 1
+
+    def __post_init__(self):
+        for prefix in self.prefixes + self.subtract:
+            if not prefix.isdigit():
+                raise ValueError(f"Account prefix must be numeric, got {prefix!r} in {self.name}")
+        if (self.numerator is None) != (self.denominator is None):
+            raise ValueError(f"{self.name} needs both a numerator and a denominator")
+
+    @property
+    def components(self) -> tuple[str, ...]:
+        if self.numerator is not None:
+            return (self.numerator, self.denominator)
+        return tuple(name for name, _ in self.terms)
+
+
+def _klassen(*ranges: tuple[int, int]) -> tuple[str, ...]:
+    return tuple(str(klasse) for start, end in ranges for klasse in range(start, end + 1))
+
+
+METRICS: dict[str, Metric] = {
+    metric.name: metric
+    for metric in (
+        Metric("EBITDA", prefixes=_klassen((60, 62), (64, 64), (70, 74))),
+        Metric("verlies", prefixes=_klassen((60, 68), (70, 78))),
+        Metric("balanstotaal", account_type=AccountType.ASSET),
+        Metric("eigen vermogen", prefixes=_klassen((10, 15))),
+        Metric("voorzieningen", prefixes=_klassen((16, 16))),
+        Metric(
+            "handelswerkkapitaal",
+            prefixes=_klassen((30, 37), (40, 40)),
+            subtract=_klassen((44, 44)),
+            sign=1,
+        ),
+        Metric("financiele schulden", prefixes=_klassen((16, 17), (42, 43))),
+        Metric("liquide middelen", prefixes=_klassen((50, 58))),
+        Metric(
+            "bruto marge",
+            prefixes=_klassen((70, 72), (74, 74)),
+            subtract=_klassen((60, 60)),
+            sign=1,
+        ),
+        Metric("omzet", prefixes=_klassen((70, 70))),
+        Metric("EBITDA marge", numerator="EBITDA", denominator="omzet"),
+        Metric("afschrijvingen", prefixes=_klassen((63, 63))),
+        Metric("EBIT", prefixes=_klassen((60, 64), (70, 74))),
+        Metric(
+            "netto financiele schuld",
+            terms=(("financiele schulden", 1), ("liquide middelen", -1)),
+        ),
+        Metric("handelsvorderingen", prefixes=_klassen((40, 40))),
+        Metric(
+            "dso",
+            numerator="handelsvorderingen",
+            denominator="omzet",
+            absolute=True,
+            scale=365,
+        ),
+    )
+}
+
+
+def _account_filter(prefixes: tuple[str, ...], account_type: AccountType | None, alias: str) -> str:
+    column = f"{alias}." if alias else ""
+    conditions = []
+    if account_type is not None:
+        conditions.append(f"{column}account_type = '{account_type}'")
+    # Two-digit prefixes hit the indexed account_class column (see database/account_class.py).
+    klassen = sorted(int(prefix) for prefix in prefixes if len(prefix) == 2)
+    if len(klassen) == 1:
+        conditions.append(f"{column}account_class = {klassen[0]}")
+    elif klassen:
+        conditions.append(f"{column}account_class IN ({', '.join(map(str, klassen))})")
+    for prefix in sorted(prefix for prefix in prefixes if len(prefix) != 2):
+        conditions.append(f"{column}account_number LIKE '{prefix}%%'")
+    return " OR ".join(conditions)
+
+
+def _wrap(expression: str) -> str:
+    return f"({expression})" if " " in expression else expression
+
+
+class MetricCompiler:
+    """
+    Compiles metrics from the registry into SQL over one shared scan of account_details.
+
+    Every distinct account filter becomes a single `SUM(value) FILTER (...)` aggregate, however
+    many metrics use it; metric expressions are then evaluated on top of those aggregates.
+    """
+
+    def __init__(self, alias: str = ""):
+        self.alias = alias
+        self._aggregates: dict[tuple, str] = {}
+
+    def _sum(self, prefixes: tuple[str, ...], account_type: AccountType | None = None) -> str:
+        key = (tuple(sorted(prefixes)), account_type)
+        if key not in self._aggregates:
+            self._aggregates[key] = f"s{len(self._aggregates)}"
+        return self._aggregates[key]
+
+    def expression(self, name: str) -> str:
+        metric = METRICS[name]
+        if metric.numerator is not None:
+            numerator = _wrap(self.expression(metric.numerator))
+            expression = f"{numerator} / NULLIF({self.expression(metric.denominator)}, 0)"
+        elif metric.terms:
+            expression = ""
+            for term, factor in metric.terms:
+                operator = "-" if factor < 0 else "+"
+                weight = f"{abs(factor)} * " if abs(factor) != 1 else ""
+                expression += f" {operator} {weight}{_wrap(self.expression(term))}"
+            expression = expression.removeprefix(" + ").strip()
+        else:
+            expression = self._sum(metric.prefixes, metric.account_type)
+            if metric.subtract:
+                expression = f"COALESCE({expression}, 0) - COALESCE({self._sum(metric.subtract)}, 0)"
+            if metric.sign != 1:
+                expression = f"{_wrap(expression)} * {metric.sign}"
+        if metric.absolute:
+            expression = f"ABS({expression})"
+        if metric.scale != 1:
+            expression = f"{_wrap(expression)} * {metric.scale}"
+        return expression
+
+    def row_filter(self) -> str:
+        """Restricts the scan to rows that feed at least one aggregate."""
+        klassen = set()
+        conditions = []
+        for prefixes, account_type in self._aggregates:
+            if account_type is not None:
+                conditions.append(_account_filter((), account_type, self.alias))
+            klassen.update(prefix for prefix in prefixes if len(prefix) == 2)
+            conditions.extend(
+                _account_filter((prefix,), None, self.alias) for prefix in prefixes if len(prefix) != 2
+            )
+        if klassen:
+            conditions.insert(0, _account_filter(tuple(klassen), None, self.alias))
+        return " OR ".join(dict.fromkeys(conditions))
+
+    def aggregate_columns(self) -> str:
+        value = f"{self.alias}.value" if self.alias else "value"
+        return ",\n                ".join(
+            f"SUM({value}) FILTER (WHERE {_account_filter(prefixes, account_type, self.alias)}) AS {column}"
+            for (prefixes, account_type), column in self._aggregates.items()
+        )
+
+
+def _metric_columns(compiler: MetricCompiler, names: list[str]) -> str:
+    return ",\n            ".join(f'{compiler.expression(name)} AS "{name}"' for name in names)
+
+
+def company_metrics_sql(names: list[str] | None = None) -> str:
+    """
+    SQL that computes the given metrics (default: all) for one company and period in a single
+    pass. Parameters: %(company_id)s, %(period_id)s.
+    """
+    names = list(names or METRICS)
+    compiler = MetricCompiler()
+    columns = _metric_columns(compiler, names)
+    return f"""
+        WITH totalen AS (
+            SELECT
+                {compiler.aggregate_columns()}
+            FROM account_details
+            WHERE company_id = %(company_id)s AND period_id = %(period_id)s
+              AND ({compiler.row_filter()})
+        )
+        SELECT
+            {columns}
+        FROM totalen;
+    """
+
+
+def ranking_sql(name: str, order_by: str = "DESC", partitioned: bool = False) -> str:
+    """
+    SQL that ranks all companies on a metric for the closing period of a fiscal year.
+    The metric's direct components are returned alongside it. `partitioned` also filters on
+    ad.fiscal_year, the partition column of the Parquet snapshot, so only that year is read.
+    Parameters: %(fiscal_year)s, %(limit)s.
+    """
+    order_by = order_by.upper()
+    if order_by not in ("ASC", "DESC"):
+        raise ValueError("order_by must be 'ASC' or 'DESC'.")
+    compiler = MetricCompiler(alias="ad")
+    columns = _metric_columns(compiler, [*METRICS[name].components, name])
+    partition = "AND ad.fiscal_year = %(fiscal_year)s " if partitioned else ""
+    return f"""
+        WITH totalen AS (
+            SELECT
+                ad.company_id,
+                {compiler.aggregate_columns()}
+            FROM fiscal_periods fp
+            JOIN account_details ad ON ad.company_id = fp.company_id AND ad.period_id = fp.period_id
+            WHERE fp.fiscal_year = %(fiscal_year)s {partition}AND ({compiler.row_filter()})
+            GROUP BY ad.company_id
+        )
+        SELECT
+            c.company_id,
+            c.name,
+            {columns}
+        FROM totalen
+        JOIN companies c ON c.company_id = totalen.company_id
+        ORDER BY "{name}" {order_by} NULLS LAST
+        LIMIT %(limit)s;
+    """
+
+
+def grouped_metrics_sql(source: str, names: list[str] | None = None) -> str:
+    """
+    SQL that computes the given metrics (default: all) per (company_id, period_id) over the
+    account_details rows selected by `source`, a FROM ... [WHERE ...] fragment that exposes
+    account_details under the alias `ad`.
+    """
+    names = list(names or METRICS)
+    compiler = MetricCompiler(alias="ad")
+    columns = _metric_columns(compiler, names)
+    return f"""
+        SELECT
+            totalen.company_id,
+            totalen.period_id,
+            {columns}
+        FROM (
+            SELECT
+                ad.company_id,
+                ad.period_id,
+                {compiler.aggregate_columns()}
+            {source}
+            GROUP BY ad.company_id, ad.period_id
+        ) AS totalen
+    """
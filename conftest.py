@@ -0,0 +1,2 @@
+# streamlit_test.py is the Streamlit app, not a test module.
+collect_ignore = ["streamlit_test.py"]
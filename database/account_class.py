@@ -0,0 +1,81 @@
+from psycopg2._psycopg import cursor
+
+# Two-digit PCMN account class (60 for 600000, 6040, ...) as a stored column, so metric
+# queries can filter with equality/IN on an index instead of SIMILAR TO regexes.
+# Adding a stored generated column rewrites account_details once; run it off-peak.
+CREATE_ACCOUNT_CLASS_SQL = """
+    ALTER TABLE account_details
+        ADD COLUMN IF NOT EXISTS account_class smallint
+        GENERATED ALWAYS AS (
+            CASE WHEN account_number ~ '^[0-9]{2}' THEN LEFT(account_number, 2)::smallint END
+        ) STORED;
+
+    CREATE INDEX IF NOT EXISTS account_details_company_period_class_idx
+        ON account_details (company_id, period_id, account_class) INCLUDE (value);
+
+    -- A period belongs to one company; without this the planner multiplies both selectivities,
+    -- estimates one row per (company, period) and keeps using the (company_id, period_id) index.
+    CREATE STATISTICS IF NOT EXISTS account_details_company_period_stats (dependencies)
+        ON company_id, period_id FROM account_details;
+
+    ANALYZE account_details;
+"""
+
+# The same EBITDA aggregation written against the old regex filter and the new column,
+# used by --explain to compare plans.
+EXPLAIN_BEFORE_SQL = """
+    EXPLAIN (ANALYZE, BUFFERS)
+    SELECT SUM(value) * -1
+    FROM account_details
+    WHERE company_id = %(company_id)s AND period_id = %(period_id)s
+      AND account_number SIMILAR TO '60%%|61%%|62%%|64%%|70%%|71%%|72%%|73%%|74%%'
+"""
+
+EXPLAIN_AFTER_SQL = """
+    EXPLAIN (ANALYZE, BUFFERS)
+    SELECT SUM(value) * -1
+    FROM account_details
+    WHERE company_id = %(company_id)s AND period_id = %(period_id)s
+      AND account_class IN (60, 61, 62, 64, 70, 71, 72, 73, 74)
+"""
+
+
+def ensure_account_class_index(cursor: cursor):
+    cursor.execute(CREATE_ACCOUNT_CLASS_SQL)
+
+
+def explain_account_class_plans(cursor: cursor, company_id: int, period_id: int) -> tuple[str, str]:
+    """Returns the (before, after) EXPLAIN ANALYZE plans of an EBITDA query for one company/period."""
+    params = {"company_id": company_id, "period_id": period_id}
+    plans = []
+    for sql in (EXPLAIN_BEFORE_SQL, EXPLAIN_AFTER_SQL):
+        cursor.execute(sql, params)
+        plans.append("\n".join(row[0] for row in cursor.fetchall()))
+    return plans[0], plans[1]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description="Adds the account_class column and index to account_details.")
+    parser.add_argument("--dsn", help="database to migrate, e.g. the benchmarks.synthetic_data database; defaults to the app database")
+    parser.add_argument("--explain", action="store_true", help="print the EBITDA plan with SIMILAR TO and with account_class")
+    args = parser.parse_args()
+
+    if args.dsn:
+        connection = psycopg2.connect(args.dsn)
+    else:
+        from utils import get_db_connection
+
+        connection = get_db_connection()
+    with connection as conn:
+        with conn.cursor() as cursor:
+            ensure_account_class_index(cursor)
+            print("account_class kolom en index aangemaakt")
+            if args.explain:
+                cursor.execute("SELECT company_id, period_id FROM account_details LIMIT 1")
+                company_id, period_id = cursor.fetchone()
+                before, after = explain_account_class_plans(cursor, company_id, period_id)
+                print(f"--- SIMILAR TO ---\n{before}\n\n--- account_class ---\n{after}")
@@ -0,0 +1,189 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable
+
+from database.statements import Statement, execute
+
+COMPANY_NAMES = Statement("company_names", "SELECT company_id, name FROM companies")
+NEW_COMPANY_NAMES = Statement(
+    "new_company_names",
+    "SELECT company_id, name FROM companies WHERE company_id > %(after)s ORDER BY company_id",
+)
+
+# Legal forms say nothing about which company is meant; they only count when the query is nothing else.
+LEGAL_FORMS = {"bv", "bvba", "nv", "commv", "comm", "v", "vof", "cv", "cvba", "vzw", "srl", "sa", "sprl", "scrl"}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased, accent-free alphanumeric tokens: "Fiduciaire Janssens-Peeters BV" -> [fiduciaire, janssens, peeters, bv]."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return [token for token in _NON_ALNUM.split(text) if token]
+
+
+def trigrams(token: str) -> set[str]:
+    """Padded trigrams like pg_trgm: "bv" -> {"  b", " bv", "bv "}."""
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def token_similarity(query: str, token: str, overlap: int) -> float:
+    if query == token:
+        return 1.0
+    similarity = overlap / (len(trigrams(query)) + len(trigrams(token)) - overlap)
+    if token.startswith(query):
+        # Typing the start of a name ("fidu") is as good as a near-exact match.
+        similarity = max(similarity, 0.9)
+    return similarity
+
+
+@dataclass
+class Match:
+    company_id: int
+    name: str
+    score: float
+
+
+class CompanyNameIndex:
+    """
+    In-memory fuzzy search over company names.
+
+    Names are split into normalized tokens; a trigram inverted index over the distinct tokens
+    finds candidates for every query token, and a company scores the average of the best
+    trigram similarity of each query token against its own tokens. Typos like "Fiduciare"
+    still match "Fiduciaire".
+
+    New companies are picked up every `refresh_interval` seconds by fetching only ids above
+    the highest one seen; a full reload every `full_refresh_interval` seconds catches renames
+    and deletions. `upsert` and `remove` let ingestion update the index directly.
+    """
+
+    def __init__(
+        self,
+        connection: Callable,
+        refresh_interval: float = 60,
+        full_refresh_interval: float = 3600,
+        min_score: float = 0.3,
+    ):
+        self.connection = connection
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.min_score = min_score
+        self._lock = threading.RLock()
+        self._names: dict[int, str] = {}
+        self._tokens: dict[int, list[str]] = {}
+        self._companies_by_token: dict[str, set[int]] = defaultdict(set)
+        self._tokens_by_trigram: dict[str, set[str]] = defaultdict(set)
+        self._max_id = 0
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def upsert(self, company_id: int, name: str):
+        with self._lock:
+            self.remove(company_id)
+            tokens = list(dict.fromkeys(tokenize(name)))
+            self._names[company_id] = name
+            self._tokens[company_id] = tokens
+            for token in tokens:
+                if not self._companies_by_token[token]:
+                    for trigram in trigrams(token):
+                        self._tokens_by_trigram[trigram].add(token)
+                self._companies_by_token[token].add(company_id)
+            self._max_id = max(self._max_id, company_id)
+
+    def remove(self, company_id: int):
+        with self._lock:
+            self._names.pop(company_id, None)
+            for token in self._tokens.pop(company_id, []):
+                companies = self._companies_by_token[token]
+                companies.discard(company_id)
+                if not companies:
+                    del self._companies_by_token[token]
+                    for trigram in trigrams(token):
+                        self._tokens_by_trigram[trigram].discard(token)
+
+    def _load(self, rows):
+        for company_id, name in rows:
+            self.upsert(int(company_id), name or "")
+
+    def refresh(self, full: bool = False):
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                if full:
+                    execute(cursor, COMPANY_NAMES)
+                else:
+                    execute(cursor, NEW_COMPANY_NAMES, {"after": self._max_id})
+                rows = cursor.fetchall()
+        with self._lock:
+            if full:
+                self._names.clear()
+                self._tokens.clear()
+                self._companies_by_token.clear()
+                self._tokens_by_trigram.clear()
+                self._max_id = 0
+                self._loaded_at = time.monotonic()
+            self._load(rows)
+            self._checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if not self._loaded_at or now - self._loaded_at > self.full_refresh_interval:
+            self.refresh(full=True)
+        elif now - self._checked_at > self.refresh_interval:
+            self.refresh()
+
+    def search(self, query: str | list[str], limit: int = 10) -> list[Match]:
+        """The best `limit` matches for `query` with a score between 0 and 1, best first."""
+        if not isinstance(query, str):
+            query = " ".join(query)
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if any(token not in LEGAL_FORMS for token in tokens):
+            tokens = [token for token in tokens if token not in LEGAL_FORMS]
+        if not tokens:
+            return []
+
+        with self._lock:
+            totals: dict[int, float] = defaultdict(float)
+            for query_token in tokens:
+                overlaps: dict[str, int] = defaultdict(int)
+                for trigram in trigrams(query_token):
+                    for token in self._tokens_by_trigram.get(trigram, ()):
+                        overlaps[token] += 1
+                # Best similarity of this query token per company, most similar tokens first.
+                best: dict[int, float] = {}
+                similarities = (
+                    (token_similarity(query_token, token, overlap), token) for token, overlap in overlaps.items()
+                )
+                for similarity, token in sorted(similarities, reverse=True):
+                    if similarity < self.min_score:
+                        break
+                    for company_id in self._companies_by_token[token]:
+                        best.setdefault(company_id, similarity)
+                for company_id, similarity in best.items():
+                    totals[company_id] += similarity
+
+            threshold = self.min_score * len(tokens)
+            top = heapq.nlargest(
+                limit,
+                (item for item in totals.items() if item[1] >= threshold),
+                key=lambda item: (item[1], -len(self._names[item[0]]), -item[0]),
+            )
+            return [Match(company_id, self._names[company_id], round(total / len(tokens), 3)) for company_id, total in top]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "companies": len(self._names),
+                "tokens": len(self._companies_by_token),
+                "trigrams": len(self._tokens_by_trigram),
+                "max_company_id": self._max_id,
+            }
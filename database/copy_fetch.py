@@ -0,0 +1,131 @@
+import tempfile
+from typing import Callable
+
+import pandas as pd
+import psycopg2.errors
+import psycopg2.extensions
+
+from database.cost_guard import CostLimits, QueryRejected, check_cost, explain_plan
+from database.streaming import (
+    StreamBudget,
+    StreamResult,
+    _frame_bytes,
+    stream_query,
+)
+from database.timing import record_query
+
+# Postgres type OIDs -> how the CSV column is read back. Everything else stays a string.
+_INTEGER_TYPES = {20, 21, 23}  # int8, int2, int4
+_FLOAT_TYPES = {700, 701, 1700}  # float4, float8, numeric
+_BOOLEAN_TYPES = {16}
+_DATE_TYPES = {1082, 1114, 1184}  # date, timestamp, timestamptz
+
+COPY_SPOOL_SIZE = 64 * 1024 * 1024  # keep COPY output in memory up to this size, then spill to disk
+
+
+def _strip(sql: str) -> str:
+    return sql.strip().rstrip(";").strip()
+
+
+def _read_options(description) -> dict:
+    dtype = {}
+    parse_dates = []
+    for column in description:
+        if column.type_code in _INTEGER_TYPES:
+            dtype[column.name] = "Int64"
+        elif column.type_code in _FLOAT_TYPES:
+            dtype[column.name] = "float64"
+        elif column.type_code in _BOOLEAN_TYPES:
+            dtype[column.name] = "boolean"
+        elif column.type_code in _DATE_TYPES:
+            parse_dates.append(column.name)
+        else:
+            dtype[column.name] = "string"
+    return {
+        "dtype": dtype,
+        "parse_dates": parse_dates,
+        "true_values": ["t"],
+        "false_values": ["f"],
+    }
+
+
+def copy_query(
+    conn: psycopg2.extensions.connection,
+    sql: str,
+    params: dict | None = None,
+    budget: StreamBudget = StreamBudget(),
+) -> StreamResult:
+    """
+    Fetches a query with `COPY (...) TO STDOUT` as CSV and parses it straight into typed pandas
+    columns, skipping per-row tuple and Decimal construction. Column types come from a
+    LIMIT 0 probe of the same query. The row budget is enforced with a LIMIT on the COPY.
+    """
+    sql = _strip(sql)
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0", params)
+        options = _read_options(cursor.description)
+        inlined = cursor.mogrify(sql, params).decode()
+        copy_sql = (
+            f"COPY (SELECT * FROM ({inlined}) AS q LIMIT {budget.max_rows + 1}) "
+            "TO STDOUT WITH (FORMAT csv, HEADER true)"
+        )
+        with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE, mode="w+b") as buffer:
+            cursor.copy_expert(copy_sql, buffer)
+            buffer.seek(0)
+            frame = pd.read_csv(buffer, keep_default_na=False, na_values=[""], **options)
+    record_query(0.0, rows=len(frame))
+
+    truncated = len(frame) > budget.max_rows
+    frame = frame.head(budget.max_rows)
+    size = _frame_bytes(frame)
+    if size > budget.max_bytes and len(frame):
+        frame = frame.head(max(1, int(len(frame) * budget.max_bytes / size)))
+        size = _frame_bytes(frame)
+        truncated = True
+    return StreamResult(
+        frame=frame,
+        rows=len(frame),
+        bytes=size,
+        truncated=truncated,
+        preview=frame.head(5),
+    )
+
+
+def fetch_frame(
+    conn: psycopg2.extensions.connection,
+    sql: str,
+    params: dict | None = None,
+    budget: StreamBudget = StreamBudget(),
+    on_batch: Callable[[pd.DataFrame], None] | None = None,
+    limits: CostLimits = CostLimits(),
+) -> StreamResult:
+    """
+    Fetches a query into a DataFrame. The planner's estimate is checked against `limits` first,
+    which can reject the query (QueryRejected) or run it with a smaller budget and timeout. The
+    transfer mode follows the row estimate: COPY above `budget.copy_threshold` rows, a streaming
+    cursor otherwise.
+    """
+    with conn.cursor() as cursor:
+        verdict = check_cost(explain_plan(cursor, sql, params), limits, budget)
+        # SET LOCAL only lasts until the pooled connection commits or rolls back this transaction.
+        cursor.execute("SET LOCAL statement_timeout = %s", (verdict.statement_timeout_ms,))
+
+    try:
+        if min(verdict.rows, verdict.budget.max_rows) <= budget.copy_threshold:
+            result = stream_query(conn, sql, params, budget=verdict.budget, on_batch=on_batch)
+        else:
+            result = copy_query(conn, sql, params, budget=verdict.budget)
+            if on_batch is not None:
+                on_batch(result.frame)
+    except psycopg2.errors.QueryCanceled:
+        conn.rollback()
+        raise QueryRejected(
+            f"Query afgebroken na {verdict.statement_timeout_ms / 1000:.0f} seconden (statement_timeout). "
+            "Herschrijf de query zodat ze minder data leest."
+        )
+    if verdict.downgraded:
+        result.notice = (
+            f"\nLet op: de query is duur (geschatte kost {verdict.cost:,.0f}, {verdict.rows:,} rijen) "
+            f"en werd beperkt tot {verdict.budget.max_rows:,} rijen. Verfijn de query voor een volledig resultaat."
+        )
+    return result
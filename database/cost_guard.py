@@ -0,0 +1,76 @@
+import json
+from dataclasses import dataclass, replace
+
+from database.streaming import _CURSOR_COMPATIBLE, StreamBudget
+
+
+class QueryRejected(Exception):
+    """Raised with a message for the agent when a query is too expensive to run."""
+
+
+@dataclass(frozen=True)
+class CostLimits:
+    # Planner cost units; a sequential scan of account_details is in the tens of thousands.
+    max_cost: float = 5_000_000
+    max_rows: int = 10_000_000
+    # Queries above these estimates still run, but with a smaller row budget and shorter timeout.
+    downgrade_cost: float = 500_000
+    downgrade_rows: int = 1_000_000
+    downgraded_max_rows: int = 10_000
+    statement_timeout_ms: int = 30_000
+    downgraded_timeout_ms: int = 10_000
+
+
+@dataclass(frozen=True)
+class CostVerdict:
+    cost: float
+    rows: int
+    budget: StreamBudget
+    statement_timeout_ms: int
+    downgraded: bool = False
+
+
+def explain_plan(cursor, sql: str, params: dict | None = None) -> dict | None:
+    """Top node of the planner's EXPLAIN (FORMAT JSON) output, or None if the statement is not a plain query."""
+    if _CURSOR_COMPATIBLE.match(sql) is None:
+        return None
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def check_cost(plan: dict | None, limits: CostLimits, budget: StreamBudget) -> CostVerdict:
+    """
+    Judges a plan against `limits`. Raises QueryRejected when the estimate is over the hard limits
+    or there is no plan to judge, otherwise returns the budget and statement_timeout the query
+    should run with.
+    """
+    if plan is None:
+        raise QueryRejected(
+            "Query geweigerd: alleen SELECT-, WITH-, VALUES- en TABLE-query's worden uitgevoerd. "
+            "Verwijder eventuele geneste commentaarblokken vooraan in de query."
+        )
+
+    cost = float(plan["Total Cost"])
+    rows = int(plan["Plan Rows"])
+    if cost > limits.max_cost:
+        raise QueryRejected(
+            f"Query geweigerd: de geschatte kost ({cost:,.0f}) is hoger dan de limiet ({limits.max_cost:,.0f}). "
+            "Herschrijf de query goedkoper: filter op company_id en period_id, vermijd cross joins en aggregeer in SQL."
+        )
+    if rows > limits.max_rows:
+        raise QueryRejected(
+            f"Query geweigerd: de query levert naar schatting {rows:,} rijen op (limiet {limits.max_rows:,}). "
+            "Voeg filters, een GROUP BY of een LIMIT toe."
+        )
+    if cost > limits.downgrade_cost or rows > limits.downgrade_rows:
+        return CostVerdict(
+            cost,
+            rows,
+            replace(budget, max_rows=min(budget.max_rows, limits.downgraded_max_rows)),
+            limits.downgraded_timeout_ms,
+            downgraded=True,
+        )
+    return CostVerdict(cost, rows, budget, limits.statement_timeout_ms)
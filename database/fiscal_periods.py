@@ -0,0 +1,105 @@
+import threading
+import time
+from datetime import date
+
+from psycopg2._psycopg import cursor
+
+from database.statements import Statement, execute
+
+# (company_id, fiscal_year) -> closing period of that fiscal year. A period closes the
+# fiscal year when it ends on fiscal_year_end; otherwise the latest period of the year wins.
+CREATE_FISCAL_PERIODS_SQL = """
+    CREATE TABLE IF NOT EXISTS fiscal_periods (
+        company_id bigint NOT NULL,
+        fiscal_year integer NOT NULL,
+        period_id bigint NOT NULL,
+        end_date date NOT NULL,
+        PRIMARY KEY (company_id, fiscal_year)
+    );
+    CREATE INDEX IF NOT EXISTS fiscal_periods_fiscal_year_idx
+        ON fiscal_periods (fiscal_year, company_id) INCLUDE (period_id);
+"""
+
+REFRESH_FISCAL_PERIODS_SQL = """
+    INSERT INTO fiscal_periods (company_id, fiscal_year, period_id, end_date)
+    SELECT DISTINCT ON (company_id, fiscal_year) company_id, fiscal_year, period_id, end_date
+    FROM (
+        SELECT company_id, EXTRACT(YEAR FROM fiscal_year_end)::integer AS fiscal_year,
+               period_id, end_date, end_date = fiscal_year_end AS closes_fiscal_year
+        FROM periods
+        WHERE fiscal_year_end IS NOT NULL AND end_date IS NOT NULL {company_filter}
+    ) AS p
+    ORDER BY company_id, fiscal_year, closes_fiscal_year DESC, end_date DESC;
+"""
+
+RESOLVE_PERIOD = Statement(
+    "resolve_fiscal_period",
+    """SELECT period_id, end_date FROM fiscal_periods
+       WHERE company_id = %(company_id)s AND fiscal_year = %(fiscal_year)s""",
+)
+
+CACHE_TTL = 600  # seconds
+
+_cache: dict[tuple[int, int], tuple[float, tuple[int, date] | None]] = {}
+_cache_lock = threading.Lock()
+
+
+def ensure_fiscal_periods_table(cursor: cursor):
+    cursor.execute(CREATE_FISCAL_PERIODS_SQL)
+
+
+def refresh_fiscal_periods(cursor: cursor, company_ids: list[int] | None = None) -> int:
+    """
+    Rebuilds the fiscal_periods lookup from `periods`, for all companies or only the given ones.
+    Runs in the caller's transaction, so readers never see a half-refreshed company.
+    Returns the number of rows written.
+    """
+    ensure_fiscal_periods_table(cursor)
+    if company_ids is None:
+        cursor.execute("DELETE FROM fiscal_periods")
+        cursor.execute(REFRESH_FISCAL_PERIODS_SQL.format(company_filter=""))
+    else:
+        company_ids = [int(company_id) for company_id in company_ids]
+        cursor.execute("DELETE FROM fiscal_periods WHERE company_id = ANY(%s)", (company_ids,))
+        cursor.execute(
+            REFRESH_FISCAL_PERIODS_SQL.format(company_filter="AND company_id = ANY(%s)"),
+            (company_ids,),
+        )
+    refreshed = cursor.rowcount
+    clear_period_cache(company_ids)
+    return refreshed
+
+
+def clear_period_cache(company_ids: list[int] | None = None):
+    with _cache_lock:
+        if company_ids is None:
+            _cache.clear()
+            return
+        company_ids = set(company_ids)
+        for key in [key for key in _cache if key[0] in company_ids]:
+            del _cache[key]
+
+
+def resolve_period(cursor: cursor, company_id: int, fiscal_year: int) -> tuple[int, date] | None:
+    """Returns (period_id, end_date) of the closing period of a fiscal year, or None."""
+    key = (int(company_id), int(fiscal_year))
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    execute(cursor, RESOLVE_PERIOD, {"company_id": key[0], "fiscal_year": key[1]})
+    row = cursor.fetchone()
+    period = (row[0], row[1]) if row else None
+    with _cache_lock:
+        _cache[key] = (now + CACHE_TTL, period)
+    return period
+
+
+if __name__ == "__main__":
+    from utils import get_db_connection
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            print(f"{refresh_fiscal_periods(cursor)} fiscale periodes vernieuwd")
@@ -0,0 +1,360 @@
+"""
+Loads the Silverfin export in silverfin_api_static_db/ into the Postgres tables the calculator reads.
+
+Each file is streamed company by company with ijson. Companies are grouped into batches of
+about `batch_rows` rows, and each batch is loaded by a worker in one transaction:
+
+- COPY into a temporary staging table.
+- A set-based merge: delete rows that vanished from the export, update rows that changed, insert
+  new rows.
+- A checkpoint row per company.
+
+Unchanged rows are not touched, so the metric cube triggers only queue periods that really
+changed. After a crash, a rerun skips the companies already checkpointed for the same version
+of the file. fiscal_periods and the metric cube are refreshed for every checkpoint that is not
+marked refreshed yet, so companies loaded before a crash are not left behind.
+
+    python -m database.ingest silverfin_api_static_db --workers 4
+"""
+import csv
+import io
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+
+from psycopg2._psycopg import cursor
+
+from calculator.metric_cube import CUBE_AVAILABLE, refresh_metric_cube
+from database.fiscal_periods import refresh_fiscal_periods
+from database.statements import execute
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CREATE_CHECKPOINTS_SQL = """
+    CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+        source text NOT NULL,
+        signature text NOT NULL,
+        company_id bigint NOT NULL,
+        rows integer NOT NULL,
+        loaded_at timestamptz NOT NULL DEFAULT now(),
+        -- false until fiscal_periods and the metric cube have been refreshed for this load
+        refreshed boolean NOT NULL DEFAULT false,
+        PRIMARY KEY (source, company_id)
+    );
+    ALTER TABLE ingest_checkpoints ADD COLUMN IF NOT EXISTS refreshed boolean NOT NULL DEFAULT false;
+"""
+
+
+@dataclass(frozen=True)
+class Source:
+    file: str
+    table: str
+    # column -> candidate paths in a JSON record, first present one wins
+    columns: dict[str, tuple[tuple[str, ...], ...]]
+    key: tuple[str, ...]
+    # Rows of the batch's companies that are missing from the export are deleted.
+    delete_missing: bool = True
+    # companies.json maps an id to one record; the other files to a list of records.
+    one_per_company: bool = False
+
+
+SOURCES = (
+    Source(
+        "companies.json",
+        "companies",
+        {"company_id": (("company_id",), ("id",)), "name": (("name",),)},
+        key=("company_id",),
+        delete_missing=False,
+        one_per_company=True,
+    ),
+    Source(
+        "periods.json",
+        "periods",
+        {
+            "period_id": (("period_id",), ("id",)),
+            "company_id": (("company_id",),),
+            "start_date": (("start_date",),),
+            "end_date": (("end_date",),),
+            "fiscal_year_end": (("fiscal_year_end",), ("fiscal_year", "end_date")),
+        },
+        key=("period_id",),
+    ),
+    Source(
+        "accounts.json",
+        "account_details",
+        {
+            "account_id": (("account_id",), ("id",)),
+            "company_id": (("company_id",),),
+            "period_id": (("period_id",), ("period", "id")),
+            "account_name": (("account_name",), ("name",)),
+            "account_number": (("account_number",), ("number",)),
+            "number_without_suffix": (("number_without_suffix",),),
+            "original_name": (("original_name",),),
+            "original_number": (("original_number",),),
+            "account_type": (("account_type",), ("type",)),
+            "reconciliation_template_id": (("reconciliation_template_id",),),
+            "value": (("value",),),
+            "starred": (("starred",),),
+        },
+        key=("period_id", "account_id"),
+    ),
+    Source(
+        "reconciliation_results.json",
+        "reconciliation_results",
+        {
+            "company_id": (("company_id",),),
+            "period_id": (("period_id",), ("period", "id")),
+            "tax_percentage": (("tax_percentage",),),
+            "prep1_made": (("prep1_made",),),
+            "prep2_made": (("prep2_made",),),
+            "prep3_made": (("prep3_made",),),
+            "prep4_made": (("prep4_made",),),
+        },
+        key=("company_id", "period_id"),
+    ),
+)
+
+
+def _pick(record: dict, paths: tuple[tuple[str, ...], ...]):
+    for path in paths:
+        value = record
+        for part in path:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            return value
+    return None
+
+
+def _rows(source: Source, company_id: str, value) -> list[tuple]:
+    records = [value] if source.one_per_company else value or []
+    rows = []
+    for record in records:
+        row = {column: _pick(record, paths) for column, paths in source.columns.items()}
+        if row.get("company_id") is None:
+            row["company_id"] = company_id
+        rows.append(tuple(row.values()))
+    return rows
+
+
+def merge_sql(source: Source) -> list[str]:
+    """Set-based merge of `ingest_stage` into the target table, for the companies in `ingest_batch`."""
+    table = source.table
+    columns = list(source.columns)
+    values = [column for column in columns if column not in source.key]
+    on_key = " AND ".join(f"t.{column} = s.{column}" for column in source.key)
+    statements = []
+    if source.delete_missing:
+        statements.append(
+            f"""DELETE FROM {table} t
+                USING ingest_batch b
+                WHERE t.company_id = b.company_id
+                  AND NOT EXISTS (SELECT 1 FROM ingest_stage s WHERE {on_key})"""
+        )
+    if values:
+        statements.append(
+            f"""UPDATE {table} t
+                SET {", ".join(f"{column} = s.{column}" for column in values)}
+                FROM ingest_stage s
+                WHERE {on_key}
+                  AND ({", ".join(f"t.{column}" for column in values)})
+                      IS DISTINCT FROM ({", ".join(f"s.{column}" for column in values)})"""
+        )
+    statements.append(
+        f"""INSERT INTO {table} ({", ".join(columns)})
+            SELECT DISTINCT ON ({", ".join(source.key)}) {", ".join(columns)}
+            FROM ingest_stage s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {on_key})"""
+    )
+    return statements
+
+
+def _signature(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Throughput:
+    def __init__(self, label: str, every: float = 5.0):
+        self.label = label
+        self.every = every
+        self.rows = 0
+        self.companies = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+        self._lock = threading.Lock()
+
+    def add(self, rows: int, companies: int):
+        with self._lock:
+            self.rows += rows
+            self.companies += companies
+            now = time.perf_counter()
+            if now - self._reported >= self.every:
+                self._reported = now
+                self.report()
+
+    def report(self, final: bool = False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        print(
+            f"{self.label:<24} {self.companies:>8} bedrijven {self.rows:>12} rijen "
+            f"{rate:>10.0f} rijen/s{'  klaar' if final else ''}"
+        )
+
+
+def _count(throughput: Throughput, companies: int, future):
+    if future.exception() is None:
+        throughput.add(future.result(), companies)
+
+
+class Ingestor:
+    def __init__(self, connection: Callable, source_dir: str, workers: int = 4, batch_rows: int = 50_000):
+        self.connection = connection
+        self.source_dir = source_dir
+        self.workers = workers
+        self.batch_rows = batch_rows
+
+    def _load_batch(self, source: Source, signature: str, batch: dict[int, list[tuple]]) -> int:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for rows in batch.values():
+            writer.writerows(rows)
+        buffer.seek(0)
+        columns = ", ".join(source.columns)
+
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMP TABLE ingest_stage ON COMMIT DROP AS SELECT {columns} FROM {source.table} WITH NO DATA"
+                )
+                cursor.copy_expert(f"COPY ingest_stage ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+                cursor.execute("CREATE TEMP TABLE ingest_batch (company_id bigint PRIMARY KEY) ON COMMIT DROP")
+                cursor.execute("INSERT INTO ingest_batch SELECT unnest(%s::bigint[])", (list(batch),))
+                cursor.execute("ANALYZE ingest_stage")
+                for statement in merge_sql(source):
+                    cursor.execute(statement)
+                cursor.execute(
+                    """
+                    INSERT INTO ingest_checkpoints (source, signature, company_id, rows)
+                    SELECT %s, %s, company_id, row_count
+                    FROM unnest(%s::bigint[], %s::integer[]) AS c(company_id, row_count)
+                    ON CONFLICT (source, company_id) DO UPDATE
+                    SET signature = EXCLUDED.signature, rows = EXCLUDED.rows, loaded_at = now(), refreshed = false
+                    """,
+                    (source.file, signature, list(batch), [len(rows) for rows in batch.values()]),
+                )
+        return sum(len(rows) for rows in batch.values())
+
+    def _done(self, source: Source, signature: str) -> set[int]:
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CREATE_CHECKPOINTS_SQL)
+                cursor.execute(
+                    "SELECT company_id FROM ingest_checkpoints WHERE source = %s AND signature = %s",
+                    (source.file, signature),
+                )
+                return {row[0] for row in cursor.fetchall()}
+
+    def ingest(self, source: Source) -> set[int]:
+        """Loads one file; returns the ids of the companies that were (re)loaded in this run."""
+        path = os.path.join(self.source_dir, source.file)
+        if not os.path.exists(path):
+            print(f"{source.file:<24} ontbreekt, overgeslagen")
+            return set()
+        signature = _signature(path)
+        done = self._done(source, signature)
+        throughput = Throughput(source.file)
+        loaded = set()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="ingest") as executor:
+            pending = set()
+
+            def submit(batch):
+                # Keep at most two batches per worker in memory.
+                while len(pending) >= 2 * self.workers:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        pending.discard(future)
+                        future.result()
+                future = executor.submit(self._load_batch, source, signature, batch)
+                future.add_done_callback(partial(_count, throughput, len(batch)))
+                pending.add(future)
+
+            batch, batch_size = {}, 0
+            with open(path, "rb") as file:
+                for company_id, value in ijson.kvitems(file, "", use_float=True):
+                    company_id = int(company_id)
+                    if company_id in done:
+                        continue
+                    rows = _rows(source, company_id, value)
+                    batch[company_id] = rows
+                    loaded.add(company_id)
+                    batch_size += len(rows)
+                    if batch_size >= self.batch_rows:
+                        submit(batch)
+                        batch, batch_size = {}, 0
+            if batch:
+                submit(batch)
+            for future in pending:
+                future.result()
+
+        throughput.report(final=True)
+        return loaded
+
+    def run(self) -> dict[str, set[int]]:
+        if ijson is None:
+            raise RuntimeError("ijson is not installed")
+        # Sources run one after the other so that companies exist before their periods and accounts.
+        loaded = {source.table: self.ingest(source) for source in SOURCES}
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                after_load(cursor)
+        return loaded
+
+
+def after_load(cursor: cursor) -> int:
+    """
+    Refreshes fiscal_periods and the metric cube for every checkpointed load that has not been
+    refreshed yet, including loads from an earlier run that crashed before getting here, and
+    marks those checkpoints refreshed in the same transaction. Returns the number of companies
+    whose fiscal periods were refreshed.
+    """
+    cursor.execute(CREATE_CHECKPOINTS_SQL)
+    cursor.execute(
+        """
+        UPDATE ingest_checkpoints SET refreshed = true
+        WHERE NOT refreshed AND source IN ('periods.json', 'accounts.json')
+        RETURNING source, company_id
+        """
+    )
+    pending = cursor.fetchall()
+    period_companies = sorted({company_id for source, company_id in pending if source == "periods.json"})
+    if period_companies:
+        refresh_fiscal_periods(cursor, period_companies)
+    execute(cursor, CUBE_AVAILABLE)
+    if pending and cursor.fetchone()[0]:
+        refresh_metric_cube(cursor)
+    return len(period_companies)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils import get_db_connection
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("source_dir", nargs="?", default="silverfin_api_static_db")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    Ingestor(get_db_connection, args.source_dir, args.workers, args.batch_rows).run()
+    print(f"Klaar in {time.perf_counter() - started:.1f}s")
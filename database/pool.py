@@ -0,0 +1,281 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+import psycopg2
+import psycopg2.extensions
+
+from database.timing import TimedCursor
+
+
+class PooledPgConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that remembers which named statements it has prepared and whose
+    cursors report their DB time to the per-tool instrumentation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: set[str] = set()
+        self.cursor_factory = TimedCursor
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+@dataclass
+class _PoolEntry:
+    conn: psycopg2.extensions.connection
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    waits: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+    timeouts: int = 0
+    created: int = 0
+    closed_idle: int = 0
+    closed_lifetime: int = 0
+    closed_broken: int = 0
+    peak_in_use: int = 0
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool shared by every Streamlit session in the process.
+
+    Connections are checked for liveness on checkout, closed after `idle_timeout` seconds
+    without use (down to `min_size`) and recycled once they are older than `max_lifetime`.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs: dict,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300,
+        max_lifetime: float = 3600,
+        checkout_timeout: float = 30,
+        health_check_interval: float = 5,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: need 0 <= min_size <= max_size and max_size >= 1")
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle: list[_PoolEntry] = []
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._stats = PoolStats()
+
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            self._release(self._connect())
+
+    def _connect(self) -> _PoolEntry:
+        try:
+            conn = psycopg2.connect(connection_factory=PooledPgConnection, **self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats.created += 1
+        return _PoolEntry(conn)
+
+    def _discard(self, entry: _PoolEntry, reason: str):
+        try:
+            entry.conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            setattr(self._stats, reason, getattr(self._stats, reason) + 1)
+            self._cond.notify()
+
+    def _expired(self, entry: _PoolEntry, now: float) -> str | None:
+        if entry.conn.closed:
+            return "closed_broken"
+        if now - entry.created_at > self.max_lifetime:
+            return "closed_lifetime"
+        return None
+
+    def _is_alive(self, entry: _PoolEntry, now: float) -> bool:
+        if now - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            with entry.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            entry.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> _PoolEntry:
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats.timeouts += 1
+                        raise PoolTimeout(
+                            f"Geen databaseverbinding beschikbaar binnen {self.checkout_timeout} seconden"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if entry is None:
+                entry = self._connect()
+            else:
+                now = time.monotonic()
+                reason = self._expired(entry, now)
+                if reason is None and not self._is_alive(entry, now):
+                    reason = "closed_broken"
+                if reason is not None:
+                    self._discard(entry, reason)
+                    continue
+
+            wait_time = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._stats.checkouts += 1
+                self._stats.peak_in_use = max(self._stats.peak_in_use, self._in_use)
+                if waited:
+                    self._stats.waits += 1
+                self._stats.wait_time_total += wait_time
+                self._stats.wait_time_max = max(self._stats.wait_time_max, wait_time)
+            return entry
+
+    def putconn(self, entry: _PoolEntry, broken: bool = False):
+        with self._cond:
+            self._in_use -= 1
+        conn = entry.conn
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        if broken or conn.closed:
+            self._discard(entry, "closed_broken")
+            return
+        reason = self._expired(entry, time.monotonic())
+        if reason is not None:
+            self._discard(entry, reason)
+            return
+        self._release(entry)
+
+    def _release(self, entry: _PoolEntry):
+        entry.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                entry.conn.close()
+                return
+            self._idle.append(entry)
+            self._cond.notify()
+        self._reap_idle()
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        reaped = []
+        with self._cond:
+            # The idle list is LIFO, so the longest-idle connections sit at the front.
+            while (
+                self._idle
+                and self._size - len(reaped) > self.min_size
+                and now - self._idle[0].last_used > self.idle_timeout
+            ):
+                reaped.append(self._idle.pop(0))
+        for entry in reaped:
+            self._discard(entry, "closed_idle")
+
+    def connection(self) -> "PooledConnection":
+        return PooledConnection(self)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = vars(self._stats).copy()
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                max_size=self.max_size,
+                saturation=self._in_use / self.max_size,
+                wait_time_avg=(
+                    self._stats.wait_time_total / self._stats.checkouts
+                    if self._stats.checkouts
+                    else 0.0
+                ),
+            )
+        return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            entry.conn.close()
+
+
+class PooledConnection:
+    """
+    Context manager that checks a connection out of the pool.
+
+    Mirrors psycopg2's own `with conn:` semantics (commit on success, rollback on error)
+    and hands the connection back to the pool instead of leaving it open.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._entry = None
+
+    def __enter__(self) -> psycopg2.extensions.connection:
+        self._entry = self._pool.getconn()
+        return self._entry.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        entry, self._entry = self._entry, None
+        conn = entry.conn
+        broken = isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        try:
+            if exc_type is None:
+                conn.commit()
+            elif not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            self._pool.putconn(entry, broken=True)
+            if exc_type is None:
+                raise
+            return False
+        self._pool.putconn(entry, broken=broken)
+        return False
@@ -0,0 +1,136 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from database.streaming import StreamResult
+
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_TABLES = re.compile(r"\b(?:from|join|into|update)\s+(?:only\s+)?([a-z_][\w.]*)")
+# Results of queries that depend on the clock or a random generator must not be reused.
+_VOLATILE = re.compile(r"\b(now|random|clock_timestamp|current_date|current_time|current_timestamp|localtime|localtimestamp)\b")
+
+
+def normalize_sql(sql: str) -> str:
+    """Lowercases and collapses whitespace outside string literals and quoted identifiers, drops comments."""
+    parts = _QUOTED.split(sql.strip().rstrip(";"))
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", _COMMENTS.sub(" ", parts[i]).lower())
+    return "".join(parts).strip()
+
+
+def referenced_tables(normalized_sql: str) -> frozenset[str]:
+    unquoted = "".join(_QUOTED.split(normalized_sql)[::2])
+    return frozenset(name.rsplit(".", 1)[-1] for name in _TABLES.findall(unquoted))
+
+
+def is_cacheable(normalized_sql: str) -> bool:
+    unquoted = "".join(_QUOTED.split(normalized_sql)[::2])
+    return unquoted.startswith(("select", "with", "values", "table", "(")) and not _VOLATILE.search(unquoted)
+
+
+@dataclass
+class _CacheEntry:
+    result: StreamResult
+    size: int
+    expires_at: float
+    tables: frozenset[str]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class ResultCache:
+    """
+    Process-wide LRU cache of query results, bounded by total result size in bytes.
+    Entries expire after `ttl` seconds and can be dropped by the tables they read from.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], _CacheEntry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    @staticmethod
+    def _key(sql: str, params: dict | None) -> tuple[str, str]:
+        return normalize_sql(sql), json.dumps(params or {}, sort_keys=True, default=str)
+
+    def _drop(self, key: tuple[str, str]):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def get(self, sql: str, params: dict | None = None) -> StreamResult | None:
+        key = self._key(sql, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return entry.result
+
+    def put(self, sql: str, params: dict | None, result: StreamResult, ttl: float | None = None):
+        key = self._key(sql, params)
+        if not is_cacheable(key[0]) or result.bytes > self.max_bytes:
+            return
+        entry = _CacheEntry(
+            result=result,
+            size=result.bytes,
+            expires_at=time.monotonic() + (self.ttl if ttl is None else ttl),
+            tables=referenced_tables(key[0]),
+        )
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._stats.stores += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def invalidate(self, *tables: str) -> int:
+        """Drops every entry that reads from one of `tables`. Returns the number of entries dropped."""
+        tables = {table.lower() for table in tables}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.tables & tables]
+            for key in stale:
+                self._drop(key)
+            self._stats.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = vars(self._stats).copy()
+            lookups = self._stats.hits + self._stats.misses
+            stats.update(
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_ratio=self._stats.hits / lookups if lookups else 0.0,
+            )
+        return stats
@@ -0,0 +1,166 @@
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+
+import psycopg2
+import psycopg2.extensions
+
+from database.pool import ConnectionPool, PooledConnection, PoolTimeout
+
+# Seconds behind the primary, or NULL when the replica is not streaming WAL. A replica that has
+# replayed everything it received counts as current, even if the primary has been idle since the
+# last replayed transaction; but without a streaming WAL receiver both LSNs simply stop moving, so
+# that case is reported as unhealthy instead of as zero lag. status is NULL for roles without
+# pg_read_all_stats; a running receiver is then taken as streaming.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+@dataclass
+class _Replica:
+    name: str
+    pool: ConnectionPool
+    down_until: float = 0.0
+    lag: float | None = None
+    lag_checked_at: float = float("-inf")
+    routed: int = 0
+    failures: int = 0
+    skipped_lag: int = 0
+
+
+class ReplicaRouter:
+    """
+    Sends read-only work round-robin to replica pools and everything else to the primary.
+
+    A replica is skipped while it is more than `max_lag` seconds behind, and for `retry_after`
+    seconds after a failed checkout. When no replica is usable, reads fall back to the primary.
+    """
+
+    def __init__(
+        self,
+        primary: ConnectionPool,
+        replicas: dict[str, ConnectionPool],
+        max_lag: float = 30,
+        lag_check_interval: float = 10,
+        retry_after: float = 30,
+    ):
+        self.primary = primary
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self._replicas = [_Replica(name, pool) for name, pool in replicas.items()]
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._primary_fallbacks = 0
+
+    def _candidates(self) -> list[_Replica]:
+        if not self._replicas:
+            return []
+        with self._lock:
+            start = next(self._next) % len(self._replicas)
+        now = time.monotonic()
+        ordered = self._replicas[start:] + self._replicas[:start]
+        return [replica for replica in ordered if replica.down_until <= now]
+
+    def _mark_down(self, replica: _Replica):
+        with self._lock:
+            replica.down_until = time.monotonic() + self.retry_after
+            replica.failures += 1
+
+    def _lagging(self, replica: _Replica, conn: psycopg2.extensions.connection) -> bool:
+        now = time.monotonic()
+        if now - replica.lag_checked_at >= self.lag_check_interval:
+            with conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+            # No WAL receiver: the replica is stale by an unknown amount.
+            lag = float("inf") if lag is None else float(lag)
+            conn.rollback()
+            with self._lock:
+                replica.lag = lag
+                replica.lag_checked_at = now
+        if replica.lag is not None and replica.lag > self.max_lag:
+            with self._lock:
+                replica.skipped_lag += 1
+            return True
+        return False
+
+    def checkout(
+        self, read_only: bool
+    ) -> tuple[PooledConnection, psycopg2.extensions.connection]:
+        """Enters a PooledConnection on a suitable replica, or on the primary."""
+        if read_only:
+            for replica in self._candidates():
+                pooled = PooledConnection(replica.pool)
+                try:
+                    conn = pooled.__enter__()
+                except (psycopg2.OperationalError, PoolTimeout):
+                    self._mark_down(replica)
+                    continue
+                try:
+                    lagging = self._lagging(replica, conn)
+                except psycopg2.Error as e:
+                    pooled.__exit__(type(e), e, None)
+                    self._mark_down(replica)
+                    continue
+                if lagging:
+                    pooled.__exit__(None, None, None)
+                    continue
+                with self._lock:
+                    replica.routed += 1
+                return pooled, conn
+            if self._replicas:
+                with self._lock:
+                    self._primary_fallbacks += 1
+
+        pooled = PooledConnection(self.primary)
+        return pooled, pooled.__enter__()
+
+    def connection(self, read_only: bool = False) -> "RoutedConnection":
+        return RoutedConnection(self, read_only)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            replicas = {
+                replica.name: {
+                    **replica.pool.stats(),
+                    "lag": replica.lag,
+                    "down": replica.down_until > now,
+                    "routed": replica.routed,
+                    "failures": replica.failures,
+                    "skipped_lag": replica.skipped_lag,
+                }
+                for replica in self._replicas
+            }
+            fallbacks = self._primary_fallbacks
+        return {
+            "primary": {**self.primary.stats(), "read_fallbacks": fallbacks},
+            "replicas": replicas,
+        }
+
+
+class RoutedConnection:
+    """`with` wrapper around ReplicaRouter.checkout, with the same commit/rollback semantics as PooledConnection."""
+
+    def __init__(self, router: ReplicaRouter, read_only: bool):
+        self._router = router
+        self._read_only = read_only
+        self._pooled = None
+
+    def __enter__(self) -> psycopg2.extensions.connection:
+        self._pooled, conn = self._router.checkout(self._read_only)
+        return conn
+
+    def __exit__(self, exc_type, exc, tb):
+        pooled, self._pooled = self._pooled, None
+        return pooled.__exit__(exc_type, exc, tb)
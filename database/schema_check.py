@@ -0,0 +1,45 @@
+from psycopg2._psycopg import cursor
+
+# Schema the metric, ranking and cube SQL relies on, with the command that creates it, in the
+# order the commands have to run. The metric cube is optional: without it rankings scan live.
+REQUIRED_MIGRATIONS = (
+    (
+        "account_details.account_class",
+        "python -m database.account_class",
+        """SELECT EXISTS (
+               SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'account_details'
+                 AND column_name = 'account_class'
+           )""",
+    ),
+    (
+        "fiscal_periods",
+        "python -m database.fiscal_periods",
+        "SELECT to_regclass('fiscal_periods') IS NOT NULL",
+    ),
+)
+
+
+class MissingMigration(RuntimeError):
+    """Raised at startup when the database lacks schema the calculator needs."""
+
+
+def missing_migrations(cursor: cursor) -> list[tuple[str, str]]:
+    """(object, command) for every required migration that has not been run, in run order."""
+    missing = []
+    for name, command, exists_sql in REQUIRED_MIGRATIONS:
+        cursor.execute(exists_sql)
+        if not cursor.fetchone()[0]:
+            missing.append((name, command))
+    return missing
+
+
+def check_migrations(cursor: cursor):
+    missing = missing_migrations(cursor)
+    if missing:
+        steps = "\n".join(f"  {command}  (creates {name})" for name, command in missing)
+        raise MissingMigration(
+            "The database is missing schema the metric queries need. Run, in this order:\n"
+            f"{steps}\n"
+            "then optionally `python -m calculator.metric_cube --full` to build the metric cube."
+        )
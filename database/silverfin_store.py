@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import ijson
+except ImportError:  # without ijson the conversion parses each file in one go
+    ijson = None
+
+# Source file -> (kind, whether each company maps to a list of records or a single value)
+SOURCES = {
+    "accounts.json": ("accounts", True),
+    "periods.json": ("periods", True),
+    "companies.json": ("company", False),
+    "company_ids.json": ("company_name", False),
+}
+
+SCHEMA_SQL = """
+    CREATE TABLE records (
+        kind text NOT NULL,
+        company_id text NOT NULL,
+        seq integer NOT NULL,
+        body text NOT NULL,
+        PRIMARY KEY (kind, company_id, seq)
+    ) WITHOUT ROWID;
+    CREATE TABLE sources (
+        name text PRIMARY KEY,
+        mtime real NOT NULL,
+        size integer NOT NULL
+    );
+"""
+
+
+def _company_items(path: str):
+    """(company_id, value) pairs of a top-level JSON object, streamed with ijson when available."""
+    with open(path, "rb") as file:
+        if ijson is not None:
+            yield from ijson.kvitems(file, "", use_float=True)
+        else:
+            yield from json.load(file).items()
+
+
+def _source_signature(path: str) -> tuple[float, int]:
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def build_store(source_dir: str, target: str) -> int:
+    """
+    Converts the JSON files in `source_dir` into a SQLite file at `target`, keyed on
+    (kind, company_id, seq). The file is written next to `target` and moved into place,
+    so open readers keep their old copy. Returns the number of records written.
+    """
+    tmp = f"{target}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    written = 0
+    db = sqlite3.connect(tmp)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(SCHEMA_SQL)
+        for name, (kind, is_list) in SOURCES.items():
+            path = os.path.join(source_dir, name)
+            if not os.path.exists(path):
+                continue
+            mtime, size = _source_signature(path)
+            for company_id, value in _company_items(path):
+                values = value if is_list and isinstance(value, list) else [value]
+                db.executemany(
+                    "INSERT INTO records (kind, company_id, seq, body) VALUES (?, ?, ?, ?)",
+                    ((kind, str(company_id), seq, json.dumps(item, default=str)) for seq, item in enumerate(values)),
+                )
+                written += len(values)
+            db.execute("INSERT INTO sources (name, mtime, size) VALUES (?, ?, ?)", (name, mtime, size))
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp, target)
+    return written
+
+
+class SilverfinStore:
+    """
+    Read-only, memory-mapped SQLite copy of silverfin_api_static_db/.
+
+    Lookups by company_id are index seeks and pages are read with a keyset cursor on `seq`,
+    so a call costs O(page) instead of parsing the whole JSON file. At most every
+    `check_interval` seconds the JSON files are compared with the sizes and mtimes recorded
+    at conversion time; when one changed the store is rebuilt and readers switch to it.
+    """
+
+    def __init__(self, source_dir: str, path: str, check_interval: float = 30, mmap_size: int = 1 << 30):
+        self.source_dir = source_dir
+        self.path = path
+        self.check_interval = check_interval
+        self.mmap_size = mmap_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            if getattr(local, "db", None) is not None:
+                local.db.close()
+            local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            local.db.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            local.generation = self._generation
+        return local.db
+
+    def _stale(self) -> bool:
+        if not os.path.exists(self.path):
+            return True
+        with sqlite3.connect(f"file:{self.path}?mode=ro", uri=True) as db:
+            recorded = {name: (mtime, size) for name, mtime, size in db.execute("SELECT name, mtime, size FROM sources")}
+        for name in SOURCES:
+            path = os.path.join(self.source_dir, name)
+            current = _source_signature(path) if os.path.exists(path) else None
+            if current != recorded.get(name):
+                return True
+        return False
+
+    def ensure_fresh(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            if self._stale():
+                build_store(self.source_dir, self.path)
+                self.reloads += 1
+                self._generation += 1
+            self._checked_at = time.monotonic()
+
+    def get(self, kind: str, company_id) -> object | None:
+        """The single value stored for `company_id`, or None."""
+        self.ensure_fresh()
+        row = self._connection().execute(
+            "SELECT body FROM records WHERE kind = ? AND company_id = ? AND seq = 0",
+            (kind, str(company_id)),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def page(self, kind: str, company_id, after: int = -1, limit: int = 100) -> tuple[list, int | None]:
+        """
+        Up to `limit` records of `company_id` with seq > `after`, and the cursor for the next
+        page (None on the last page).
+        """
+        self.ensure_fresh()
+        rows = self._connection().execute(
+            "SELECT seq, body FROM records WHERE kind = ? AND company_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (kind, str(company_id), int(after), int(limit) + 1),
+        ).fetchall()
+        items = [json.loads(body) for _, body in rows[:limit]]
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return items, next_cursor
+
+    def exists(self, kind: str, company_id) -> bool:
+        self.ensure_fresh()
+        row = self._connection().execute(
+            "SELECT 1 FROM records WHERE kind = ? AND company_id = ? LIMIT 1", (kind, str(company_id))
+        ).fetchone()
+        return row is not None
+
+
+if __name__ == "__main__":
+    import sys
+
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else "silverfin_api_static_db"
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.join(source_dir, "store.sqlite")
+    start = time.perf_counter()
+    records = build_store(source_dir, target)
+    print(f"{records} records naar {target} in {time.perf_counter() - start:.1f}s")
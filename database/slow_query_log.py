@@ -0,0 +1,135 @@
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from database.result_cache import normalize_sql
+from database.streaming import _CURSOR_COMPATIBLE
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s")
+
+
+def fingerprint(sql: str) -> str:
+    """Normalized SQL with literals and parameters replaced by `?`, so similar queries group together."""
+    return _LITERALS.sub("?", normalize_sql(sql))
+
+
+class SlowQueryLog:
+    """
+    Captures queries slower than `threshold` seconds with an EXPLAIN (ANALYZE, BUFFERS) plan.
+
+    The plan is produced on a background thread over its own connection, inside a read-only
+    transaction that is rolled back, and written as one JSON line to a rotating log file.
+    When `max_pending` captures are already queued, new slow queries are logged without a plan.
+    """
+
+    def __init__(
+        self,
+        connection: Callable,
+        threshold: float = 2.0,
+        path: str = "logs/slow_queries.log",
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        max_pending: int = 20,
+        explain_timeout_ms: int = 60_000,
+    ):
+        self.connection = connection
+        self.threshold = threshold
+        self.path = path
+        self.explain_timeout_ms = explain_timeout_ms
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self.captured = 0
+        self.skipped = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._logger = logging.getLogger(f"{__name__}.{path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def observe(self, sql: str, params: dict | None, duration: float, source: str):
+        if duration < self.threshold:
+            return
+        record = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "source": source,
+            "duration": round(duration, 3),
+            "fingerprint": fingerprint(sql),
+            "sql": sql,
+            "params": params,
+        }
+        if _CURSOR_COMPATIBLE.match(sql) is None or not self._pending.acquire(blocking=False):
+            self.skipped += 1
+            self._write(record)
+            return
+        self._executor.submit(self._capture, record)
+
+    def _capture(self, record: dict):
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cursor:
+                    # EXPLAIN ANALYZE runs the query, so it must not be able to change anything.
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                    cursor.execute("SET LOCAL statement_timeout = %s", (self.explain_timeout_ms,))
+                    cursor.execute(
+                        f"EXPLAIN (ANALYZE, BUFFERS) {record['sql'].strip().rstrip(';')}",
+                        record["params"],
+                    )
+                    record["plan"] = "\n".join(row[0] for row in cursor.fetchall())
+                conn.rollback()
+            self.captured += 1
+        except Exception as e:
+            record["plan_error"] = f"{type(e).__name__}: {e}"
+        finally:
+            self._pending.release()
+        self._write(record)
+
+    def _write(self, record: dict):
+        self._logger.info(json.dumps(record, default=str))
+
+
+def summarize(path: str = "logs/slow_queries.log", top: int = 20) -> list[dict]:
+    """Groups the log and its rotated files by query shape, slowest total time first."""
+    durations = defaultdict(list)
+    examples = {}
+    for file in glob.glob(f"{glob.escape(path)}*"):
+        with open(file) as log:
+            for line in log:
+                record = json.loads(line)
+                durations[record["fingerprint"]].append(record["duration"])
+                examples.setdefault(record["fingerprint"], record["sql"])
+    shapes = []
+    for shape, values in durations.items():
+        values.sort()
+        shapes.append(
+            {
+                "fingerprint": shape,
+                "count": len(values),
+                "total": sum(values),
+                "p50": values[len(values) // 2],
+                "max": values[-1],
+                "example": examples[shape],
+            }
+        )
+    return sorted(shapes, key=lambda shape: shape["total"], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    import sys
+
+    for shape in summarize(*sys.argv[1:2]):
+        print(
+            f"{shape['count']:>5}x  totaal {shape['total']:>8.1f}s  p50 {shape['p50']:>6.1f}s  "
+            f"max {shape['max']:>6.1f}s\n       {shape['fingerprint']}"
+        )
@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # the snapshot is optional; without duckdb everything runs against Postgres
+    duckdb = None
+
+# Only the closing periods are snapshotted: rankings and batch metrics never read other periods.
+ACCOUNT_DETAILS_EXPORT_SQL = """
+    COPY (
+        SELECT ad.company_id, ad.period_id, ad.account_class, ad.account_number, ad.account_type, ad.value
+        FROM fiscal_periods fp
+        JOIN account_details ad ON ad.company_id = fp.company_id AND ad.period_id = fp.period_id
+        WHERE fp.fiscal_year = {fiscal_year}
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+EXPORTS = {
+    "companies": (
+        "COPY (SELECT company_id, name FROM companies) TO STDOUT WITH (FORMAT csv, HEADER true)",
+        {"company_id": "BIGINT", "name": "VARCHAR"},
+    ),
+    "fiscal_periods": (
+        "COPY (SELECT company_id, fiscal_year, period_id, end_date FROM fiscal_periods) "
+        "TO STDOUT WITH (FORMAT csv, HEADER true)",
+        {"company_id": "BIGINT", "fiscal_year": "INTEGER", "period_id": "BIGINT", "end_date": "DATE"},
+    ),
+}
+ACCOUNT_DETAILS_COLUMNS = {
+    "company_id": "BIGINT",
+    "period_id": "BIGINT",
+    "account_class": "SMALLINT",
+    "account_number": "VARCHAR",
+    "account_type": "VARCHAR",
+    "value": "DOUBLE",
+}
+
+_PARAM = re.compile(r"%\((\w+)\)s")
+_ANY_PARAM = re.compile(r"([\w.]+)\s*=\s*ANY\(\s*%\((\w+)\)s\s*\)")
+
+
+def to_duckdb_sql(sql: str) -> str:
+    """Turns psycopg2-style SQL from the metric builders into DuckDB SQL with $name parameters."""
+    sql = _ANY_PARAM.sub(r"list_contains($\2, \1)", sql)
+    return _PARAM.sub(r"$\1", sql).replace("%%", "%").strip().rstrip(";")
+
+
+def _copy_to_parquet(cursor, export_sql: str, columns: dict, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=".csv") as csv:
+        cursor.copy_expert(export_sql, csv)
+        csv.flush()
+        with duckdb.connect() as db:
+            db.execute(
+                f"COPY (SELECT * FROM read_csv(?, header = true, columns = {columns!r})) "
+                f"TO '{target}' (FORMAT parquet)",
+                [csv.name],
+            )
+
+
+def build_snapshot(cursor, root: str, keep: int = 2) -> dict:
+    """
+    Exports companies, fiscal_periods and the closing-period account_details (partitioned by
+    fiscal_year) to a new Parquet version under `root`, then points `root/CURRENT` at it.
+    Older versions beyond `keep` are removed. Returns the new manifest.
+    """
+    if duckdb is None:
+        raise RuntimeError("duckdb is not installed")
+    started = time.perf_counter()
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(root, version)
+
+    for table, (export_sql, columns) in EXPORTS.items():
+        _copy_to_parquet(cursor, export_sql, columns, os.path.join(path, f"{table}.parquet"))
+    cursor.execute("SELECT DISTINCT fiscal_year FROM fiscal_periods ORDER BY fiscal_year")
+    fiscal_years = [row[0] for row in cursor.fetchall()]
+    for fiscal_year in fiscal_years:
+        _copy_to_parquet(
+            cursor,
+            ACCOUNT_DETAILS_EXPORT_SQL.format(fiscal_year=int(fiscal_year)),
+            ACCOUNT_DETAILS_COLUMNS,
+            os.path.join(path, "account_details", f"fiscal_year={fiscal_year}", "part.parquet"),
+        )
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "fiscal_years": fiscal_years,
+        "build_seconds": round(time.perf_counter() - started, 1),
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as file:
+        json.dump(manifest, file)
+
+    pointer = os.path.join(root, "CURRENT.tmp")
+    with open(pointer, "w") as file:
+        file.write(version)
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+
+    versions = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return manifest
+
+
+class AnalyticsSnapshot:
+    """Read side of the Parquet snapshot: DuckDB views named like the Postgres tables."""
+
+    def __init__(self, path: str, manifest: dict):
+        self.path = path
+        self.manifest = manifest
+        self.created_at = datetime.fromisoformat(manifest["created_at"])
+        self.fiscal_years = set(manifest["fiscal_years"])
+
+    @classmethod
+    def open(cls, root: str | None) -> "AnalyticsSnapshot | None":
+        """The current snapshot under `root`, or None if there is none or duckdb is missing."""
+        if duckdb is None or not root:
+            return None
+        try:
+            with open(os.path.join(root, "CURRENT")) as file:
+                path = os.path.join(root, file.read().strip())
+            with open(os.path.join(path, "manifest.json")) as file:
+                return cls(path, json.load(file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def age_seconds(self) -> float:
+        return (datetime.now(timezone.utc) - self.created_at).total_seconds()
+
+    def is_fresh(self, max_age: float) -> bool:
+        return self.age_seconds() <= max_age
+
+    def covers(self, fiscal_years) -> bool:
+        return set(fiscal_years) <= self.fiscal_years
+
+    def query(self, sql: str, params: dict | None = None) -> pd.DataFrame:
+        """Runs builder SQL (psycopg2 placeholders, Postgres table names) on the snapshot."""
+        with duckdb.connect() as db:
+            db.execute(f"CREATE VIEW companies AS SELECT * FROM read_parquet('{self.path}/companies.parquet')")
+            db.execute(
+                f"CREATE VIEW fiscal_periods AS SELECT * FROM read_parquet('{self.path}/fiscal_periods.parquet')"
+            )
+            db.execute(
+                "CREATE VIEW account_details AS SELECT * FROM read_parquet("
+                f"'{self.path}/account_details/*/*.parquet', hive_partitioning = true)"
+            )
+            return db.execute(to_duckdb_sql(sql), params or {}).df()
+
+
+if __name__ == "__main__":
+    import streamlit as st
+
+    from utils import get_db_connection
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            manifest = build_snapshot(cursor, st.secrets["SNAPSHOT_DIR"])
+    print(f"Snapshot {manifest['version']} met boekjaren {manifest['fiscal_years']} in {manifest['build_seconds']}s")
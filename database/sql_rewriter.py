@@ -0,0 +1,176 @@
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import Scope, traverse_scope
+except ImportError:  # the rewriter is optional; without sqlglot queries run as written
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+# Every rewrite is written here as one JSON line; the app configures no logging of its own.
+AUDIT_LOG_PATH = "logs/sql_rewrites.log"
+_audit_lock = threading.Lock()
+_audit_handler: logging.Handler | None = None
+
+
+def _audit_logger() -> logging.Logger:
+    global _audit_handler
+    with _audit_lock:
+        if _audit_handler is None:
+            os.makedirs(os.path.dirname(AUDIT_LOG_PATH) or ".", exist_ok=True)
+            _audit_handler = logging.handlers.RotatingFileHandler(
+                AUDIT_LOG_PATH, maxBytes=10 * 1024 * 1024, backupCount=5
+            )
+            _audit_handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(_audit_handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+
+# Tables with enough columns that `SELECT *` in a CTE or subquery is worth narrowing down.
+WIDE_TABLES = {"account_details"}
+
+
+def _inject_limit(tree, limit: int) -> bool:
+    if not isinstance(tree, (exp.Select, exp.Union)) or tree.args.get("limit") is not None:
+        return False
+    tree.set("limit", exp.Limit(expression=exp.Literal.number(limit)))
+    return True
+
+
+def _is_wide_star_select(select) -> bool:
+    if not isinstance(select, exp.Select) or len(select.expressions) != 1:
+        return False
+    if not isinstance(select.expressions[0], exp.Star) or select.args.get("joins"):
+        return False
+    # The FROM clause is stored as "from" or "from_" depending on the sqlglot version.
+    source = next((arg for arg in select.args.values() if isinstance(arg, exp.From)), None)
+    table = source.this if source is not None else None
+    return isinstance(table, exp.Table) and table.name.lower() in WIDE_TABLES
+
+
+def _project_stars(tree) -> bool:
+    """Replaces `SELECT *` on a wide table inside a CTE or subquery by the columns read from it."""
+    referenced: dict[int, set[str]] = {}
+    unsafe: set[int] = set()
+    selects: dict[int, "exp.Select"] = {}
+
+    scopes = traverse_scope(tree)
+    correlated = any(
+        column.table and column.table not in scope.sources
+        for scope in scopes
+        for column in scope.columns
+    )
+    for scope in scopes:
+        wide = {
+            name: source.expression
+            for name, source in scope.sources.items()
+            if isinstance(source, Scope) and _is_wide_star_select(source.expression)
+        }
+        if not wide:
+            continue
+        for select in wide.values():
+            selects[id(select)] = select
+            referenced.setdefault(id(select), set())
+
+        if any(isinstance(projection, exp.Star) for projection in scope.expression.expressions):
+            unsafe.update(id(select) for select in wide.values())
+        # USING and NATURAL joins read the join columns without naming their source.
+        if any(
+            join.args.get("using") or (join.method or "").upper() == "NATURAL"
+            for join in scope.expression.args.get("joins") or []
+        ):
+            unsafe.update(id(select) for select in wide.values())
+        for column in scope.columns:
+            if isinstance(column.this, exp.Star):
+                if column.table in wide:
+                    unsafe.add(id(wide[column.table]))
+            elif column.table in wide:
+                referenced[id(wide[column.table])].add(column.name)
+            elif not column.table:
+                # An unqualified name may be a column of any source, an outer column or the alias
+                # itself as a whole-row value (`SELECT to_jsonb(ad) FROM ad`).
+                unsafe.update(id(select) for select in wide.values())
+
+    changed = False
+    for key, select in selects.items():
+        # Correlated subqueries may read columns through an outer alias; leave those queries alone.
+        if correlated or key in unsafe or not referenced[key]:
+            continue
+        select.set("expressions", [exp.column(name) for name in sorted(referenced[key])])
+        changed = True
+    return changed
+
+
+def _year_range(column, year: int):
+    return exp.Paren(
+        this=exp.and_(
+            exp.GTE(this=column.copy(), expression=exp.cast(exp.Literal.string(f"{year}-01-01"), "date")),
+            exp.LT(this=column.copy(), expression=exp.cast(exp.Literal.string(f"{year + 1}-01-01"), "date")),
+        )
+    )
+
+
+def _sargable_years(tree) -> bool:
+    """
+    Turns `EXTRACT(YEAR FROM col) = N` into `col >= 'N-01-01' AND col < 'N+1-01-01'`. Only plain
+    columns compared with an integer are rewritten; `EXTRACT(YEAR FROM age(col))` is not a date.
+    """
+    changed = False
+    for eq in list(tree.find_all(exp.EQ)):
+        for extract, literal in ((eq.this, eq.expression), (eq.expression, eq.this)):
+            if (
+                isinstance(extract, exp.Extract)
+                and extract.this.name.upper() == "YEAR"
+                and isinstance(extract.expression, exp.Column)
+                and isinstance(literal, exp.Literal)
+                and not literal.is_string
+                and literal.this.isdigit()
+            ):
+                eq.replace(_year_range(extract.expression, int(literal.this)))
+                changed = True
+                break
+    return changed
+
+
+def rewrite_sql(sql: str, limit: int | None = None) -> str:
+    """
+    Rewrites agent SQL to be cheaper before it runs: adds `LIMIT limit` to an unbounded top-level
+    query, narrows `SELECT *` on wide tables in CTEs and subqueries to the columns used, and makes
+    year filters on date columns sargable. Returns `sql` unchanged if it can't be parsed.
+    """
+    if sqlglot is None:
+        return sql
+    try:
+        statements = sqlglot.parse(sql, read="postgres")
+    except sqlglot.errors.SqlglotError:
+        return sql
+    if len(statements) != 1 or statements[0] is None:
+        return sql
+
+    tree = statements[0]
+    applied = []
+    try:
+        if _project_stars(tree):
+            applied.append("projection")
+        if _sargable_years(tree):
+            applied.append("year range")
+        if limit is not None and _inject_limit(tree, limit):
+            applied.append("limit")
+        rewritten = tree.sql(dialect="postgres")
+    except (sqlglot.errors.SqlglotError, ValueError):
+        return sql
+    if not applied:
+        return sql
+
+    record = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "rewrites": applied, "before": sql, "after": rewritten}
+    _audit_logger().info(json.dumps(record))
+    return rewritten
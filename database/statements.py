@@ -0,0 +1,128 @@
+import hashlib
+import re
+import threading
+from dataclasses import dataclass, field
+
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2._psycopg import cursor
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+@dataclass(frozen=True)
+class Statement:
+    """
+    A named, parameterized SQL statement.
+
+    `sql` uses psycopg2's %(name)s placeholders. On a pooled connection the statement is
+    PREPAREd once per connection and afterwards run with EXECUTE, so Postgres parses and
+    plans it only once per session.
+    """
+
+    name: str
+    sql: str
+    param_names: tuple[str, ...] = field(init=False)
+    prepared_sql: str = field(init=False)
+
+    def __post_init__(self):
+        names = tuple(dict.fromkeys(_PLACEHOLDER.findall(self.sql)))
+        positions = {name: index + 1 for index, name in enumerate(names)}
+        prepared_sql = _PLACEHOLDER.sub(lambda m: f"${positions[m.group(1)]}", self.sql)
+        object.__setattr__(self, "param_names", names)
+        object.__setattr__(self, "prepared_sql", prepared_sql.replace("%%", "%").rstrip().rstrip(";"))
+
+    @classmethod
+    def from_sql(cls, prefix: str, sql: str) -> "Statement":
+        """Statement for generated SQL, named after a hash of its text."""
+        digest = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        return cls(f"{prefix}_{digest}", sql)
+
+    @property
+    def execute_sql(self) -> str:
+        if not self.param_names:
+            return f"EXECUTE {self.name}"
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * len(self.param_names))})"
+
+
+@dataclass
+class StatementStats:
+    prepares: int = 0
+    hits: int = 0
+    unprepared: int = 0
+    # re-prepared after a schema change made the cached plan's result type stale
+    replans: int = 0
+
+
+_stats: dict[str, StatementStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(name: str, kind: str):
+    with _stats_lock:
+        stats = _stats.setdefault(name, StatementStats())
+        setattr(stats, kind, getattr(stats, kind) + 1)
+
+
+def execute(cursor: cursor, statement: Statement, params: dict | None = None):
+    """Runs `statement` on `cursor`, preparing it first if this connection hasn't yet."""
+    params = params or {}
+    prepared = getattr(cursor.connection, "prepared_statements", None)
+    if prepared is None:  # Not a pooled connection, fall back to a plain parameterized query
+        cursor.execute(statement.sql, params)
+        _record(statement.name, "unprepared")
+        return
+
+    values = [params[name] for name in statement.param_names]
+    if statement.name not in prepared:
+        cursor.execute(f"PREPARE {statement.name} AS {statement.prepared_sql}")
+        prepared.add(statement.name)
+        _record(statement.name, "prepares")
+        cursor.execute(statement.execute_sql, values)
+        return
+
+    _record(statement.name, "hits")
+    connection = cursor.connection
+    idle = connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        cursor.execute(statement.execute_sql, values)
+    except psycopg2.errors.FeatureNotSupported as e:
+        # A column added to a table behind the statement (e.g. ALTER TABLE ... ADD COLUMN)
+        # makes Postgres refuse the cached plan until the statement is prepared again.
+        # Retrying means rolling back, which is only harmless when this was the transaction's
+        # first statement; otherwise the caller gets the error and the next call re-prepares.
+        if "cached plan must not change result type" not in str(e) or not idle:
+            raise
+        connection.rollback()
+        cursor.execute(f"DEALLOCATE {statement.name}")
+        cursor.execute(f"PREPARE {statement.name} AS {statement.prepared_sql}")
+        _record(statement.name, "replans")
+        cursor.execute(statement.execute_sql, values)
+
+
+def statement_stats() -> dict:
+    """
+    Client-side plan-cache counters: `prepares` are parse/plan misses (once per statement
+    per pooled connection), `hits` are executions that reused a prepared plan.
+    """
+    with _stats_lock:
+        per_statement = {name: vars(stats).copy() for name, stats in _stats.items()}
+    totals = StatementStats()
+    for stats in per_statement.values():
+        totals.prepares += stats["prepares"]
+        totals.hits += stats["hits"]
+        totals.unprepared += stats["unprepared"]
+        totals.replans += stats["replans"]
+    executions = totals.prepares + totals.hits
+    return {
+        "totals": {**vars(totals), "hit_ratio": totals.hits / executions if executions else 0.0},
+        "statements": per_statement,
+    }
+
+
+def server_plan_stats(cursor: cursor) -> list[tuple]:
+    """Per-statement generic/custom plan counts Postgres reports for this session (PG 14+)."""
+    cursor.execute(
+        "SELECT name, generic_plans, custom_plans FROM pg_prepared_statements ORDER BY name"
+    )
+    return cursor.fetchall()
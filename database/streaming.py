@@ -0,0 +1,100 @@
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Callable
+
+import pandas as pd
+import psycopg2.extensions
+
+# Plain queries, the only statements that can be declared as a server-side cursor. check_cost
+# rejects anything else (SHOW, EXPLAIN, DML, ...) before fetch_frame streams it. Leading comments
+# are skipped, except nested block comments: Postgres nests them, so what follows the first `*/`
+# may still be commented out.
+_CURSOR_COMPATIBLE = re.compile(
+    r"^(?:\s+|--[^\n]*(?:\n|$)|/\*(?:(?!/\*).)*?\*/)*(\(\s*)*(SELECT|WITH|VALUES|TABLE)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+@dataclass(frozen=True)
+class StreamBudget:
+    max_rows: int = 100_000
+    max_bytes: int = 200 * 1024 * 1024
+    batch_size: int = 5_000
+    copy_threshold: int = 50_000
+
+
+@dataclass
+class StreamResult:
+    frame: pd.DataFrame
+    rows: int
+    bytes: int
+    truncated: bool
+    preview: pd.DataFrame
+    notice: str = ""
+
+
+def _frame_bytes(frame: pd.DataFrame) -> int:
+    return int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def stream_query(
+    conn: psycopg2.extensions.connection,
+    sql: str,
+    params: dict | None = None,
+    budget: StreamBudget = StreamBudget(),
+    on_batch: Callable[[pd.DataFrame], None] | None = None,
+) -> StreamResult:
+    """
+    Runs `sql` through a named server-side cursor and pulls it in `fetchmany` batches until the
+    row or byte budget is reached. Hitting the budget closes the cursor, which stops the query on
+    the server. `on_batch` receives the rows fetched so far after every batch. `sql` must match
+    _CURSOR_COMPATIBLE; fetch_frame guarantees that through the cost check.
+    """
+    if _CURSOR_COMPATIBLE.match(sql) is None:
+        raise ValueError("stream_query only runs plain SELECT/WITH/VALUES/TABLE queries")
+    cursor = conn.cursor(name=f"load_data_{uuid.uuid4().hex[:12]}")
+    frames = []
+    columns = []
+    rows = size = 0
+    truncated = False
+    preview = None
+    try:
+        cursor.itersize = budget.batch_size
+        cursor.execute(sql, params)
+        if cursor.description is not None:
+            columns = [column[0] for column in cursor.description]
+        while True:
+            batch = cursor.fetchmany(min(budget.batch_size, budget.max_rows - rows + 1))
+            if not batch:
+                break
+            if rows + len(batch) > budget.max_rows:
+                batch = batch[: budget.max_rows - rows]
+                truncated = True
+            columns = [column[0] for column in cursor.description]
+            frame = pd.DataFrame(batch, columns=columns)
+            if preview is None:
+                preview = frame.head(5)
+            frames.append(frame)
+            rows += len(frame)
+            size += _frame_bytes(frame)
+            if size > budget.max_bytes:
+                truncated = True
+            if on_batch is not None:
+                on_batch(pd.concat(frames, ignore_index=True))
+            if truncated:
+                break
+    finally:
+        cursor.close()
+    if truncated:
+        # Drop the half-read portal before the connection goes back to the pool.
+        conn.rollback()
+
+    full = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    return StreamResult(
+        frame=full,
+        rows=rows,
+        bytes=size,
+        truncated=truncated,
+        preview=preview if preview is not None else full,
+    )
@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import psycopg2.extensions
+
+
+@dataclass
+class QueryTiming:
+    db_time: float = 0.0
+    rows: int = 0
+    queries: int = 0
+
+
+_current: ContextVar[QueryTiming | None] = ContextVar("query_timing", default=None)
+
+
+@contextmanager
+def track_queries():
+    """Collects DB time and fetched rows of every TimedCursor used inside the block."""
+    timing = QueryTiming()
+    token = _current.set(timing)
+    try:
+        yield timing
+    finally:
+        _current.reset(token)
+
+
+def record_query(elapsed: float, rows: int = 0, queries: int = 0):
+    timing = _current.get()
+    if timing is not None:
+        timing.db_time += elapsed
+        timing.rows += rows
+        timing.queries += queries
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports time spent in execute/fetch/copy calls to the active track_queries block."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(time.perf_counter() - start, queries=1)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(time.perf_counter() - start, queries=1)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(time.perf_counter() - start, queries=1)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        record_query(time.perf_counter() - start, rows=row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        record_query(time.perf_counter() - start, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        record_query(time.perf_counter() - start, rows=len(rows))
+        return rows
@@ -1,29 +1,233 @@
+import functools
+import hashlib
 import os
-from openai import OpenAI
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from openai import APIConnectionError, APITimeoutError, OpenAI, RateLimitError
 #Create connection with vectorDB(Milvus)
 from pymilvus import MilvusClient
-from tqdm import tqdm
 import json
 import streamlit as st
 
+from embedding_cache import EmbeddingCache
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a characters-per-token estimate
+    tiktoken = None
+
 
 OPENAI_API_KEY = st.secrets['OPENAI_API_KEY']
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+# OpenAI embedding limits: 8191 tokens per input, 2048 inputs and 300k tokens per request.
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
 
-def emb_text(text):
-    return (
-        openai_client.embeddings.create(input=text, model="text-embedding-3-small")
-        .data[0]
-        .embedding
+
+@st.cache_resource
+def get_embedding_cache():
+    return EmbeddingCache(
+        st.secrets.get("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite"),
+        memory_items=int(st.secrets.get("EMBEDDING_CACHE_MEMORY_ITEMS", 10_000)),
+        dtype=st.secrets.get("EMBEDDING_CACHE_DTYPE", "float16"),
     )
 
+
+def _create_embeddings(texts, model, dimensions=None):
+    extra = {"dimensions": dimensions} if dimensions else {}
+    response = openai_client.embeddings.create(input=texts, model=model, **extra)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def emb_text(text):
+    model = "text-embedding-3-small"
+    return get_embedding_cache().embed(model, None, [text], lambda texts: _create_embeddings(texts, model))[0]
+
 def emb_text_d756(text):
-    return (
-        openai_client.embeddings.create(input=text, model="text-embedding-3-small", dimensions=756)
-        .data[0]
-        .embedding
+    model = "text-embedding-3-small"
+    return get_embedding_cache().embed(
+        model, 756, [text], lambda texts: _create_embeddings(texts, model, dimensions=756)
+    )[0]
+
+class _Tokenizer:
+    def __init__(self, model):
+        self.encoding = None
+        if tiktoken is None:
+            return
+        try:
+            name = tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            name = "cl100k_base"
+        try:
+            self.encoding = tiktoken.get_encoding(name)
+        except (OSError, ValueError):  # the encoding is downloaded on first use; estimate when that fails
+            pass
+
+    def fit(self, text, max_tokens):
+        """`text` cut to at most `max_tokens` tokens, and its token count."""
+        text = text.replace("\n", " ") or " "
+        if self.encoding is None:
+            text = text[: max_tokens * 3]
+            return text, len(text) // 3 + 1
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            text = self.encoding.decode(tokens)
+        return text, len(tokens)
+
+
+@functools.lru_cache
+def _tokenizer(model):
+    return _Tokenizer(model)
+
+
+def pack_batches(token_counts, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_inputs=MAX_BATCH_INPUTS):
+    """Splits the positions 0..n-1 into consecutive (start, end) ranges within both limits."""
+    batches = []
+    start = tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (tokens + count > max_batch_tokens or i - start >= max_batch_inputs):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+class AdaptiveLimiter:
+    """
+    Caps the number of requests in flight. The cap halves on every rate limit and grows by one
+    after a full round of successes; a rate limit also pauses all workers for the backoff delay.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self.throttled = 0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def success(self):
+        with self._condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self.successes = 0
+                self._condition.notify()
+
+    def throttle(self, delay):
+        with self._condition:
+            self.throttled += 1
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def embed_texts(
+    texts,
+    model="text-embedding-3-small",
+    dimensions=None,
+    max_batch_tokens=MAX_BATCH_TOKENS,
+    max_batch_inputs=MAX_BATCH_INPUTS,
+    max_concurrency=4,
+    max_retries=8,
+    base_url=None,
+    api_key=None,
+    cache=True,
+):
+    """
+    Embeds `texts` with as few requests as possible and returns the vectors in input order.
+
+    Texts are packed into requests within the token and input limits and sent by at most
+    `max_concurrency` workers. Rate limits (429), timeouts and connection errors are retried
+    with exponential backoff, honouring Retry-After, and lower the concurrency; any other
+    error is raised.
+    Texts over MAX_INPUT_TOKENS are truncated. `base_url` (or the OPENAI_BASE_URL secret)
+    points the client at another OpenAI-compatible server, e.g. a local fake for tests.
+    Texts already in the embedding cache are not sent at all unless `cache` is off.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    if cache:
+        return get_embedding_cache().embed(
+            model,
+            dimensions,
+            texts,
+            lambda misses: embed_texts(
+                misses, model, dimensions, max_batch_tokens, max_batch_inputs,
+                max_concurrency, max_retries, base_url, api_key, cache=False,
+            ),
+        )
+    client = OpenAI(
+        api_key=api_key or OPENAI_API_KEY,
+        base_url=base_url or st.secrets.get("OPENAI_BASE_URL"),
+        max_retries=0,
     )
+    tokenizer = _tokenizer(model)
+    fitted = [tokenizer.fit(text, MAX_INPUT_TOKENS) for text in texts]
+    inputs = [text for text, _ in fitted]
+    batches = pack_batches([count for _, count in fitted], max_batch_tokens, max_batch_inputs)
+    limiter = AdaptiveLimiter(max_concurrency)
+    vectors = [None] * len(texts)
+    extra = {"dimensions": dimensions} if dimensions else {}
+
+    def run(batch):
+        start, end = batch
+        for attempt in range(max_retries + 1):
+            with limiter:
+                try:
+                    response = client.embeddings.create(input=inputs[start:end], model=model, **extra)
+                except RateLimitError as e:
+                    error, delay = e, _retry_after(e)
+                except (APITimeoutError, APIConnectionError) as e:
+                    error, delay = e, None
+                else:
+                    for item in response.data:
+                        vectors[start + item.index] = item.embedding
+                    limiter.success()
+                    return
+            if attempt == max_retries:
+                raise error
+            backoff = min(60.0, 0.5 * 2**attempt) * (0.5 + random.random())
+            limiter.throttle(delay if delay is not None else backoff)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed") as executor:
+        for future in [executor.submit(run, batch) for batch in batches]:
+            future.result()
+    return vectors
+
 
 @st.cache_resource
 def get_cloud_client():
@@ -70,10 +274,136 @@ def get_query_embeddings(client,question, collection_name):
     retrieved_lines_with_distances = [(res["entity"]["text"]) for res in search_res[0]]
     return retrieved_lines_with_distances
 
-def insert_embeddings(client, embeddings, collection_name):
-    data = []
+def content_id(text):
+    """Stable, positive int64 Milvus id derived from the text, so re-inserting the same chunk upserts it."""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big") >> 1
+
+
+def embedded(texts, chunk_size=1000, **kwargs):
+    """Yields (text, vector) pairs, embedding `texts` lazily in chunks of `chunk_size` with embed_texts."""
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= chunk_size:
+            yield from zip(chunk, embed_texts(chunk, **kwargs))
+            chunk = []
+    if chunk:
+        yield from zip(chunk, embed_texts(chunk, **kwargs))
+
+
+def _row_batches(embeddings, max_batch_rows, max_batch_bytes):
+    batch, size = [], 0
+    for text, vector in embeddings:
+        row = {"id": content_id(text), "vector": vector, "text": text}
+        row_size = 4 * len(vector) + len(text.encode()) + 8
+        if batch and (len(batch) >= max_batch_rows or size + row_size > max_batch_bytes):
+            yield batch, size
+            batch, size = [], 0
+        batch.append(row)
+        size += row_size
+    if batch:
+        yield batch, size
+
+
+def _write_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp, path)
 
-    for i,line in enumerate(tqdm(embeddings, desc="Creating embeddings")):
-        data.append({"id": i, "vector": line[1], "text": line[0]})
-    client.insert(collection_name=collection_name, data=data)
 
+def _checkpoint_path(collection_name, checkpoint_path=None):
+    checkpoint_path = checkpoint_path or os.path.join("cache", f"milvus_{collection_name}.checkpoint.json")
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    return checkpoint_path
+
+
+def _resume_point(checkpoint_path, collection_name):
+    """Number of input rows an earlier, interrupted run already inserted into `collection_name`."""
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as file:
+        state = json.load(file)
+    if state.get("collection") != collection_name:
+        return 0
+    print(f"Hervat na {state['rows']} rijen uit {checkpoint_path}")
+    return state["rows"]
+
+
+def insert_texts(
+    client, texts, collection_name, chunk_size=1000, embed_kwargs=None, checkpoint_path=None, **kwargs
+):
+    """
+    Embeds `texts` with `embedded` and upserts them with `insert_embeddings`. On resume the
+    checkpointed texts are dropped before embedding, so they cost no cache lookups or API calls.
+    """
+    checkpoint_path = _checkpoint_path(collection_name, checkpoint_path)
+    resumed = _resume_point(checkpoint_path, collection_name)
+    pairs = embedded(islice(texts, resumed, None), chunk_size, **(embed_kwargs or {}))
+    return insert_embeddings(
+        client, pairs, collection_name, checkpoint_path=checkpoint_path, resumed=resumed, **kwargs
+    )
+
+
+def insert_embeddings(
+    client,
+    embeddings,
+    collection_name,
+    max_batch_rows=1000,
+    max_batch_bytes=4 * 1024 * 1024,
+    checkpoint_path=None,
+    max_retries=3,
+    report_every=10.0,
+    resumed=None,
+):
+    """
+    Upserts (text, vector) pairs from any iterable into `collection_name` in batches of at most
+    `max_batch_rows` rows and `max_batch_bytes` bytes.
+
+    Ids come from `content_id`, so a re-run overwrites instead of duplicating. After every
+    batch the number of consumed pairs is written to a checkpoint file; a run that finds the
+    checkpoint skips that many pairs of the (same) input and continues. Pass `resumed` when
+    the caller already left those pairs out of `embeddings`, as insert_texts does. Skipping
+    pairs still produces them, so to embed texts use insert_texts, which skips before
+    embedding. The checkpoint is removed once everything is inserted. Returns rows, batches,
+    bytes and rows/s.
+    """
+    checkpoint_path = _checkpoint_path(collection_name, checkpoint_path)
+    if resumed is None:
+        resumed = _resume_point(checkpoint_path, collection_name)
+        embeddings = islice(embeddings, resumed, None)
+
+    stats = {"rows": 0, "batches": 0, "bytes": 0, "skipped": resumed}
+    started = reported = time.perf_counter()
+    for batch, size in _row_batches(embeddings, max_batch_rows, max_batch_bytes):
+        for attempt in range(max_retries + 1):
+            try:
+                client.upsert(collection_name=collection_name, data=batch)
+                break
+            except Exception:
+                if attempt == max_retries:
+                    raise
+                time.sleep(min(30.0, 2**attempt) * (0.5 + random.random()))
+        stats["rows"] += len(batch)
+        stats["batches"] += 1
+        stats["bytes"] += size
+        _write_checkpoint(checkpoint_path, {"collection": collection_name, "rows": resumed + stats["rows"]})
+
+        now = time.perf_counter()
+        if now - reported >= report_every:
+            reported = now
+            print(
+                f"{collection_name}: {stats['rows']} rijen in {stats['batches']} batches, "
+                f"{stats['rows'] / (now - started):.0f} rijen/s, {stats['bytes'] / (now - started) / 1e6:.1f} MB/s"
+            )
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["rows_per_second"] = stats["rows"] / elapsed if elapsed else 0.0
+    print(
+        f"{collection_name}: {stats['rows']} rijen in {stats['batches']} batches, "
+        f"{stats['seconds']}s, {stats['rows_per_second']:.0f} rijen/s"
+    )
+    return stats
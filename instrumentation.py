@@ -0,0 +1,187 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llama_index.core.tools.types import AsyncBaseTool, ToolMetadata, ToolOutput
+
+from database.timing import track_queries
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTES_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+HISTOGRAMS = {
+    "tool_wall_seconds": ("Wall time per tool call", SECONDS_BUCKETS),
+    "tool_db_seconds": ("Time spent in database calls per tool call", SECONDS_BUCKETS),
+    "tool_rows": ("Rows fetched from the database per tool call", ROWS_BUCKETS),
+    "tool_payload_bytes": ("Size of the tool output returned to the agent", BYTES_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class ToolMetrics:
+    """Process-wide per-tool histograms and call/error counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        self._calls: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+
+    def record(self, tool: str, wall: float, db: float, rows: int, payload: int, failed: bool):
+        with self._lock:
+            self._calls[tool] = self._calls.get(tool, 0) + 1
+            if failed:
+                self._errors[tool] = self._errors.get(tool, 0) + 1
+            for name, value in (
+                ("tool_wall_seconds", wall),
+                ("tool_db_seconds", db),
+                ("tool_rows", rows),
+                ("tool_payload_bytes", payload),
+            ):
+                key = (name, tool)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self._histograms[key].observe(value)
+
+    def summary(self) -> list[dict]:
+        """One row per tool with call counts and p50/p95 of every histogram, for the admin page."""
+        with self._lock:
+            rows = []
+            for tool in sorted(self._calls):
+                row = {"tool": tool, "calls": self._calls[tool], "errors": self._errors.get(tool, 0)}
+                for name in HISTOGRAMS:
+                    histogram = self._histograms[(name, tool)]
+                    row[f"{name}_p50"] = histogram.quantile(0.5)
+                    row[f"{name}_p95"] = histogram.quantile(0.95)
+                    row[f"{name}_avg"] = histogram.sum / histogram.count
+                rows.append(row)
+        return rows
+
+    def prometheus_text(self, gauges: dict[str, float] | None = None) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f"# HELP kc_{name} {help_text}")
+                lines.append(f"# TYPE kc_{name} histogram")
+                for (metric, tool), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f'kc_{name}_bucket{{tool="{tool}",le="{bound}"}} {cumulative}')
+                    lines.append(f'kc_{name}_sum{{tool="{tool}"}} {histogram.sum}')
+                    lines.append(f'kc_{name}_count{{tool="{tool}"}} {histogram.count}')
+            for name, values in (("tool_calls_total", self._calls), ("tool_errors_total", self._errors)):
+                lines.append(f"# TYPE kc_{name} counter")
+                for tool, value in sorted(values.items()):
+                    lines.append(f'kc_{name}{{tool="{tool}"}} {value}')
+        family = None
+        for name, value in sorted((gauges or {}).items()):
+            # Gauge names may carry labels, e.g. pool_size{pool="primary"}; TYPE goes on the bare name.
+            if name.split("{")[0] != family:
+                family = name.split("{")[0]
+                lines.append(f"# TYPE kc_{family} gauge")
+            lines.append(f"kc_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+TOOL_METRICS = ToolMetrics()
+
+
+def _payload_bytes(output: ToolOutput) -> int:
+    return len(str(output.content).encode())
+
+
+class InstrumentedTool(AsyncBaseTool):
+    """Wraps any llama_index tool and records its wall time, DB time, rows and payload size."""
+
+    def __init__(self, tool, metrics: ToolMetrics = TOOL_METRICS):
+        self._tool = tool
+        self._metrics = metrics
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return self._tool.metadata
+
+    def _record(self, start: float, timing, output: ToolOutput | None):
+        self._metrics.record(
+            self.metadata.name,
+            wall=time.perf_counter() - start,
+            db=timing.db_time,
+            rows=timing.rows,
+            payload=_payload_bytes(output) if output is not None else 0,
+            failed=output is None or bool(getattr(output, "is_error", False)),
+        )
+
+    def call(self, *args, **kwargs) -> ToolOutput:
+        start = time.perf_counter()
+        output = None
+        with track_queries() as timing:
+            try:
+                output = self._tool.call(*args, **kwargs)
+            finally:
+                self._record(start, timing, output)
+        return output
+
+    async def acall(self, *args, **kwargs) -> ToolOutput:
+        start = time.perf_counter()
+        output = None
+        with track_queries() as timing:
+            try:
+                output = await self._tool.acall(*args, **kwargs)
+            finally:
+                self._record(start, timing, output)
+        return output
+
+
+def start_metrics_server(port: int, render) -> ThreadingHTTPServer:
+    """Serves `render()` on http://0.0.0.0:<port>/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
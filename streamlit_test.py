@@ -22,7 +22,8 @@ from llama_index.embeddings.openai import (
 from llama_index.llms.openai import OpenAI
 from llama_index.vector_stores.postgres import PGVectorStore
 
-from calculator.calculator import bereken, vergelijk_op_basis_van
+from calculator.calculator import bereken, bereken_many, vergelijk_op_basis_van
+from db_client import get_embedding_cache
 from tools import (
     account_details,
     add,
@@ -90,11 +91,42 @@ cloud_aws_vector_store = create_db_connection()
 email_regex = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
 
 
+class CachedOpenAIEmbedding(OpenAIEmbedding):
+    """OpenAIEmbedding that looks every text up in the shared embedding cache before calling OpenAI."""
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._get_cached(self._query_engine, [query], super()._get_text_embeddings)[0]
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._get_cached(self._text_engine, [text], super()._get_text_embeddings)[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._get_cached(self._text_engine, texts, super()._get_text_embeddings)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return (await get_embedding_cache().aembed(
+            self._query_engine, self.dimensions, [query], super()._aget_text_embeddings
+        ))[0]
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return (await get_embedding_cache().aembed(
+            self._text_engine, self.dimensions, [text], super()._aget_text_embeddings
+        ))[0]
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return await get_embedding_cache().aembed(
+            self._text_engine, self.dimensions, texts, super()._aget_text_embeddings
+        )
+
+    def _get_cached(self, engine: str, texts: list[str], embed) -> list[list[float]]:
+        return get_embedding_cache().embed(engine, self.dimensions, texts, embed)
+
+
 @st.cache_resource
 def vector_store_index(_cloud_aws_vector_store):
     index = VectorStoreIndex.from_vector_store(
         cloud_aws_vector_store,
-        embed_model=OpenAIEmbedding(
+        embed_model=CachedOpenAIEmbedding(
             mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
             model=OpenAIEmbeddingModelType.TEXT_EMBED_3_SMALL,
             dimensions=756,
@@ -157,8 +189,17 @@ budget_tool = QueryEngineTool.from_defaults(
     description=description,
 )
 
+from database.schema_check import MissingMigration
+from database.statements import execute, statement_stats
+from instrumentation import TOOL_METRICS, InstrumentedTool, start_metrics_server
+from tools import DESCRIBE_TABLE, LIST_TABLES
 from utils import (
+    check_schema,
+    get_company_index,
     get_db_connection,
+    get_pool_stats,
+    get_result_cache,
+    load_data_preview,
 )
 def list_tables():
     """
@@ -166,10 +207,9 @@ def list_tables():
     Returns:
         list: Lijst van tabelnamen in het 'public' schema.
     """
-    sql = "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(sql)
+            execute(cursor, LIST_TABLES)
             result = cursor.fetchall()
     return result
 
@@ -182,10 +222,9 @@ def describe_tables(table_name: str):
     Returns:
         list: Lijst van kolomnamen en hun datatypes voor de opgegeven tabel.
     """
-    sql = f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{table_name}'"
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(sql)
+            execute(cursor, DESCRIBE_TABLE, {"table_name": table_name})
             result = cursor.fetchall()
     return result
 
@@ -202,15 +241,10 @@ def load_data(sql_query: str):
         
     Opmerking:
         Gebruik eerst de functies list_tables en describe_tables voor context.
+    Foutafhandeling:
+        Geeft een foutbericht terug als de query te duur is volgens de planner of te lang duurt. Herschrijf de query dan goedkoper.
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(sql_query)
-            result = cursor.fetchall()
-            full_df = pd.DataFrame(result)
-            st.session_state.data = full_df
-            st.session_state.data.columns =[ x[0] for x in cursor.description ]
-            return "Het volgende is een preview van data, de user krijgt de hele data te zien. Jij, de chatbot krijgt een deel omdat er anders het risico is om jou context window te overflowen. Vermeld in je antwoord dat jij een preview hebt van de data en de volledige data rechts van de chat te vinden is!" +  str(full_df.head(1))
+    return load_data_preview(sql_query)
 
 @st.cache_resource
 def load_tools():
@@ -227,11 +261,12 @@ def load_tools():
     load_data_tool = FunctionTool.from_defaults(fn=load_data)
     vergelijk_op_basis_van_tool = FunctionTool.from_defaults(vergelijk_op_basis_van)
     bereken_tool = FunctionTool.from_defaults(bereken)
+    bereken_many_tool = FunctionTool.from_defaults(bereken_many)
     get_datum_tool = FunctionTool.from_defaults(get_date)
     voorafbetaling_tool = FunctionTool.from_defaults(fn=voorafbetaling)
 
 
-    return [
+    tools = [
         budget_tool,
         tarief_tax_tool,
         companies_tool,
@@ -244,11 +279,53 @@ def load_tools():
         # balanstotaal_tool, eigen_vermogen_tool, handelswerkkapitaal_tool, bruto_marge_tool, omzet_tool, handelsvorderingen_tool, DSO_tool,
         # voorzieningen_tool, financiele_schuld_tool, liquide_middelen_tool, EBITDA_marge_tool, afschrijvingen_tool, EBIT_tool, netto_financiele_schuld_tool
         bereken_tool,
+        bereken_many_tool,
         vergelijk_op_basis_van_tool,
         get_datum_tool,
         voorafbetaling_tool
     ]
+    return [InstrumentedTool(tool) for tool in tools]
+
+
+def metrics_gauges() -> dict[str, float]:
+    """Pool, routing, cache, prepared statement and company index counters, flattened for the metrics export."""
+    gauges = {}
+    pools = get_pool_stats()
+    for key, value in pools["primary"].items():
+        gauges[f'pool_{key}{{pool="primary"}}'] = value
+    for name, stats in pools["replicas"].items():
+        for key, value in stats.items():
+            if value is not None:
+                gauges[f'pool_{key}{{pool="{name}"}}'] = value
+    for key, value in get_result_cache().stats().items():
+        gauges[f"result_cache_{key}"] = value
+    for key, value in statement_stats()["totals"].items():
+        gauges[f"prepared_statements_{key}"] = value
+    for key, value in get_company_index().stats().items():
+        gauges[f"company_index_{key}"] = value
+    for key, value in get_embedding_cache().stats().items():
+        gauges[f"embedding_cache_{key}"] = value
+    return {name: float(value) for name, value in gauges.items()}
+
+
+def render_metrics() -> str:
+    return TOOL_METRICS.prometheus_text(metrics_gauges())
+
 
+@st.cache_resource
+def metrics_server():
+    """Exposes /metrics for scraping when METRICS_PORT is set."""
+    port = st.secrets.get("METRICS_PORT")
+    return start_metrics_server(int(port), render_metrics) if port else None
+
+
+metrics_server()
+
+try:
+    check_schema()
+except MissingMigration as e:
+    st.error(str(e))
+    st.stop()
 
 
 
@@ -374,6 +451,9 @@ with st.sidebar.container():
     voorkeuren = st.button("Voorkeuren", use_container_width=True, on_click=popup)
     rapporten = st.button("Rapporten", use_container_width=True, on_click=popup)
     uitloggen = st.button("Log Uit", use_container_width=True, on_click=popup)
+    admin = st.session_state.get("username") in st.secrets.get("ADMIN_USERS", []) and st.button(
+        "Admin", use_container_width=True
+    )
 
 
 if st.secrets["PROD"] == "False" and "username" in st.session_state:
@@ -434,11 +514,15 @@ if (
 ):
     st.session_state["active_section"] = "Uitloggen"
 
+if admin:
+    st.session_state["active_section"] = "Admin"
+
 
 if st.session_state["active_section"] == "Chatbot":
     st.title("Knowledge Center")
     col1, col2 = st.columns([1,1])
-    col2.dataframe(st.session_state.data, use_container_width=True, height=500)
+    st.session_state.data_placeholder = col2.empty()
+    st.session_state.data_placeholder.dataframe(st.session_state.data, use_container_width=True, height=500)
     # if "chart"  in st.session_state:
     #     col2.line_chart(st.session_state.data)
     client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
@@ -610,6 +694,38 @@ elif st.session_state["active_section"] == "Rapporten":
             time.sleep(3)
             st.success("Uitgevoerd!")
 
+elif st.session_state["active_section"] == "Admin":
+    st.title("Admin")
+    st.subheader("Tools")
+    st.caption("p50/p95 worden geschat uit de histogrambuckets.")
+    st.dataframe(pd.DataFrame(TOOL_METRICS.summary()), use_container_width=True)
+
+    pools = get_pool_stats()
+    st.subheader("Databaseverbindingen")
+    st.dataframe(
+        pd.DataFrame({"primary": pools["primary"], **pools["replicas"]}).T,
+        use_container_width=True,
+    )
+
+    st.subheader("Result cache")
+    st.json(get_result_cache().stats())
+
+    st.subheader("Bedrijfsindex")
+    st.json(get_company_index().stats())
+
+    st.subheader("Embedding cache")
+    st.json(get_embedding_cache().stats())
+
+    st.subheader("Prepared statements")
+    statements = statement_stats()
+    st.json(statements["totals"])
+    st.dataframe(pd.DataFrame(statements["statements"]).T, use_container_width=True)
+
+    with st.expander("Prometheus export"):
+        metrics_text = render_metrics()
+        st.code(metrics_text, language="text")
+        st.download_button("Download metrics", metrics_text, file_name="metrics.txt")
+
 elif st.session_state["active_section"] == "Uitloggen":
     st.title("Welkom bij het Knowledge Center!")
     # log_out = st.button("Log uit")
@@ -0,0 +1,154 @@
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+openai = pytest.importorskip("openai")
+pytest.importorskip("pymilvus")
+st = pytest.importorskip("streamlit")
+
+MODEL = "text-embedding-3-small"
+
+
+class FakeEmbeddings(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible /embeddings endpoint. Each text is embedded as [its number, its length],
+    and the items are returned in reverse order so callers have to sort on `index`. The first
+    requests are answered with the (status, headers) pairs queued in `server.errors`.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append((time.monotonic(), body["input"]))
+            error = server.errors.pop(0) if server.errors else None
+        if error:
+            status, headers = error
+            self._reply(status, {"error": {"message": f"HTTP {status}", "type": "test"}}, headers)
+            return
+        data = [
+            {"object": "embedding", "index": index, "embedding": [float(text.split()[-1]), float(len(text))]}
+            for index, text in enumerate(body["input"])
+        ]
+        usage = {"prompt_tokens": 0, "total_tokens": 0}
+        self._reply(200, {"object": "list", "data": data[::-1], "model": body["model"], "usage": usage})
+
+    def _reply(self, status, payload, headers=None):
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def db_client():
+    # db_client reads the API key from the Streamlit secrets at import time.
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(st, "secrets", {"OPENAI_API_KEY": "test"})
+        yield importlib.import_module("db_client")
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddings)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.errors = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def embed(db_client, server, texts, **kwargs):
+    return db_client.embed_texts(
+        texts, MODEL, base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="test", cache=False, **kwargs
+    )
+
+
+def test_pack_batches_respects_both_limits(db_client):
+    assert db_client.pack_batches([3, 3, 3, 3, 3], max_batch_tokens=7, max_batch_inputs=10) == [(0, 2), (2, 4), (4, 5)]
+    assert db_client.pack_batches([1] * 5, max_batch_tokens=100, max_batch_inputs=2) == [(0, 2), (2, 4), (4, 5)]
+    # An input over the token limit still goes out, alone.
+    assert db_client.pack_batches([2, 9, 2], max_batch_tokens=5, max_batch_inputs=10) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_requests_are_packed_within_the_token_limit(db_client, server):
+    texts = [f"{'woord ' * (i % 7)}tekst {i}" for i in range(200)]
+    tokenizer = db_client._tokenizer(MODEL)
+    counts = {text: tokenizer.fit(text, db_client.MAX_INPUT_TOKENS)[1] for text in texts}
+
+    embed(db_client, server, texts, max_batch_tokens=100, max_batch_inputs=50)
+
+    sent = [inputs for _, inputs in server.requests]
+    assert sorted(text for inputs in sent for text in inputs) == sorted(texts)
+    assert all(len(inputs) <= 50 and sum(counts[text] for text in inputs) <= 100 for inputs in sent)
+    # One request per batch of the packing plan, none split or merged.
+    assert len(sent) == len(db_client.pack_batches([counts[text] for text in texts], 100, 50))
+
+
+def test_output_order_matches_input(db_client, server):
+    texts = [f"tekst {i}" for i in range(100)]
+
+    vectors = embed(db_client, server, texts, max_batch_tokens=40, max_concurrency=4)
+
+    assert len(server.requests) > 1
+    assert vectors == [[float(i), float(len(text))] for i, text in enumerate(texts)]
+
+
+def test_rate_limit_waits_for_retry_after(db_client, server):
+    server.errors = [(429, {"retry-after": "0.5"})]
+
+    vectors = embed(db_client, server, ["tekst 0", "tekst 1"], max_concurrency=1)
+
+    assert vectors == [[0.0, 7.0], [1.0, 7.0]]
+    (limited_at, _), (retried_at, inputs) = server.requests
+    assert inputs == ["tekst 0", "tekst 1"]
+    assert retried_at - limited_at >= 0.5
+
+
+def test_other_client_errors_are_not_retried(db_client, server):
+    server.errors = [(400, None)]
+
+    with pytest.raises(openai.BadRequestError):
+        embed(db_client, server, ["tekst 0"], max_retries=3)
+    assert len(server.requests) == 1
+
+
+class FakeMilvus:
+    def __init__(self):
+        self.rows = []
+
+    def upsert(self, collection_name, data):
+        self.rows.extend(data)
+
+
+def test_resume_skips_checkpointed_texts_before_embedding(db_client, server, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"collection": "docs", "rows": 3}))
+    texts = [f"tekst {i}" for i in range(5)]
+    embed_kwargs = {
+        "model": MODEL, "base_url": f"http://127.0.0.1:{server.server_port}/v1", "api_key": "test", "cache": False
+    }
+
+    milvus = FakeMilvus()
+    stats = db_client.insert_texts(
+        milvus, iter(texts), "docs", embed_kwargs=embed_kwargs, checkpoint_path=str(checkpoint), report_every=60
+    )
+
+    assert [inputs for _, inputs in server.requests] == [["tekst 3", "tekst 4"]]
+    assert [row["text"] for row in milvus.rows] == ["tekst 3", "tekst 4"]
+    assert (stats["skipped"], stats["rows"]) == (3, 2)
+    assert not checkpoint.exists()
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from embedding_cache import EmbeddingCache
+
+
+def test_disk_items_counts_distinct_keys_without_scanning(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(path)
+
+    cache.put_many("model", None, ["a", "b", "a"], [[1.0], [2.0], [3.0]])
+    cache.put_many("model", None, ["b", "c"], [[4.0], [5.0]])
+
+    assert cache.stats()["disk_items"] == 3
+    # A new process starts from the count on disk.
+    assert EmbeddingCache(path).stats()["disk_items"] == 3
+    assert cache.get_many("model", None, ["a", "b"]) == [[3.0], [4.0]]
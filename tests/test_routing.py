@@ -0,0 +1,155 @@
+from types import SimpleNamespace
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from database import routing
+from database.pool import _PoolEntry
+from database.routing import REPLICA_LAG_SQL, ReplicaRouter
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.pool.queries.append(sql)
+
+    def fetchone(self):
+        return (self.conn.pool.lag,)
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """
+    Stands in for ConnectionPool: hands out fake connections that answer REPLICA_LAG_SQL with
+    `lag`, or fails every checkout with OperationalError while `down` is set.
+    """
+
+    def __init__(self, lag=0.0, down=False):
+        self.lag = lag
+        self.down = down
+        self.checkouts = 0
+        self.queries = []
+
+    def getconn(self):
+        if self.down:
+            raise psycopg2.OperationalError("could not connect")
+        self.checkouts += 1
+        return _PoolEntry(FakeConnection(self))
+
+    def putconn(self, entry, broken=False):
+        pass
+
+    def stats(self):
+        return {"checkouts": self.checkouts}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(routing, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def routed_to(router, read_only=True):
+    with router.connection(read_only) as conn:
+        return conn.pool
+
+
+def test_reads_round_robin_over_replicas_and_writes_go_to_the_primary(clock):
+    primary, first, second = FakePool(), FakePool(), FakePool()
+    router = ReplicaRouter(primary, {"first": first, "second": second})
+
+    assert [routed_to(router) for _ in range(4)] == [first, second, first, second]
+    assert routed_to(router, read_only=False) is primary
+    stats = router.stats()
+    assert [stats["replicas"][name]["routed"] for name in ("first", "second")] == [2, 2]
+    assert stats["primary"]["read_fallbacks"] == 0
+
+
+def test_lagging_replica_is_skipped(clock):
+    primary, lagging, current = FakePool(), FakePool(lag=120.0), FakePool(lag=1.5)
+    router = ReplicaRouter(primary, {"lagging": lagging, "current": current}, max_lag=30)
+
+    assert [routed_to(router) for _ in range(3)] == [current, current, current]
+    stats = router.stats()["replicas"]
+    assert stats["lagging"]["lag"] == 120.0
+    assert stats["lagging"]["skipped_lag"] == 2
+    # The lag is measured once per lag_check_interval, not on every checkout.
+    assert lagging.queries == [REPLICA_LAG_SQL]
+
+
+def test_replica_without_wal_receiver_is_skipped(clock):
+    primary, detached = FakePool(), FakePool(lag=None)
+    router = ReplicaRouter(primary, {"detached": detached})
+
+    assert routed_to(router) is primary
+    assert router.stats()["replicas"]["detached"]["lag"] == float("inf")
+
+
+def test_lag_is_rechecked_after_the_interval(clock):
+    primary, replica = FakePool(), FakePool(lag=120.0)
+    router = ReplicaRouter(primary, {"replica": replica}, max_lag=30, lag_check_interval=10)
+
+    assert routed_to(router) is primary
+    replica.lag = 0.0
+    clock.now += 5
+    assert routed_to(router) is primary
+    clock.now += 5
+    assert routed_to(router) is replica
+
+
+def test_failed_replica_is_retried_after_retry_after(clock):
+    primary, failing, healthy = FakePool(), FakePool(down=True), FakePool()
+    router = ReplicaRouter(primary, {"failing": failing, "healthy": healthy}, retry_after=30)
+
+    assert [routed_to(router) for _ in range(3)] == [healthy, healthy, healthy]
+    assert router.stats()["replicas"]["failing"] == {
+        "checkouts": 0, "lag": None, "down": True, "routed": 0, "failures": 1, "skipped_lag": 0
+    }
+
+    failing.down = False
+    clock.now += 29
+    assert routed_to(router) is healthy
+    clock.now += 1
+    assert {routed_to(router) for _ in range(2)} == {failing, healthy}
+    assert router.stats()["replicas"]["failing"]["down"] is False
+
+
+def test_reads_fall_back_to_the_primary_when_no_replica_is_usable(clock):
+    primary, down, lagging = FakePool(), FakePool(down=True), FakePool(lag=300.0)
+    router = ReplicaRouter(primary, {"down": down, "lagging": lagging})
+
+    assert [routed_to(router) for _ in range(3)] == [primary, primary, primary]
+    assert router.stats()["primary"]["read_fallbacks"] == 3
+
+
+def test_without_replicas_reads_use_the_primary_without_counting_a_fallback(clock):
+    primary = FakePool()
+    router = ReplicaRouter(primary, {})
+
+    assert routed_to(router) is primary
+    assert router.stats()["primary"]["read_fallbacks"] == 0
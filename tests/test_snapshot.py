@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from calculator.metrics import grouped_metrics_sql, ranking_sql
+from database.snapshot import AnalyticsSnapshot
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """
+    A snapshot with EBITDA accounts for two companies in fiscal year 2022. The 2023 partition
+    is not valid Parquet, so any query that does not prune it fails.
+    """
+    path = str(tmp_path)
+    with duckdb.connect() as db:
+        db.execute(
+            "COPY (SELECT * FROM (VALUES (1, 'Alfa'), (2, 'Beta')) AS t(company_id, name))"
+            f" TO '{path}/companies.parquet'"
+        )
+        db.execute(
+            "COPY (SELECT * FROM (VALUES (1, 2022, 10, DATE '2022-12-31'), (2, 2022, 20, DATE '2022-12-31'))"
+            f" AS t(company_id, fiscal_year, period_id, end_date)) TO '{path}/fiscal_periods.parquet'"
+        )
+        os.makedirs(f"{path}/account_details/fiscal_year=2022")
+        db.execute(
+            "COPY (SELECT * FROM (VALUES"
+            " (1, 10, 70, '700000', 'income', -500.0), (1, 10, 60, '600000', 'expense', 200.0),"
+            " (2, 20, 70, '700000', 'income', -900.0)"
+            ") AS t(company_id, period_id, account_class, account_number, account_type, value))"
+            f" TO '{path}/account_details/fiscal_year=2022/part.parquet'"
+        )
+    os.makedirs(f"{path}/account_details/fiscal_year=2023")
+    with open(f"{path}/account_details/fiscal_year=2023/part.parquet", "wb") as file:
+        file.write(b"not parquet")
+    manifest = {"version": "test", "created_at": "2026-01-01T00:00:00+00:00", "fiscal_years": [2022, 2023]}
+    with open(f"{path}/manifest.json", "w") as file:
+        json.dump(manifest, file)
+    return AnalyticsSnapshot(path, manifest)
+
+
+def test_ranking_reads_only_the_requested_partition(snapshot):
+    ranking = snapshot.query(ranking_sql("EBITDA", partitioned=True), {"fiscal_year": 2022, "limit": 10})
+
+    assert ranking["company_id"].tolist() == [2, 1]
+    assert ranking["EBITDA"].tolist() == [900.0, 300.0]
+
+
+def test_unpartitioned_ranking_scans_every_year(snapshot):
+    with pytest.raises(duckdb.Error):
+        snapshot.query(ranking_sql("EBITDA"), {"fiscal_year": 2022, "limit": 10})
+
+
+def test_any_filter_on_fiscal_year_prunes_partitions(snapshot):
+    sql = grouped_metrics_sql("FROM account_details ad WHERE ad.fiscal_year = ANY(%(fiscal_years)s)", ["omzet"])
+
+    metrics = snapshot.query(sql, {"fiscal_years": [2022]}).sort_values("company_id")
+
+    assert metrics["omzet"].tolist() == [500.0, 900.0]
@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+import json
+
+from database import sql_rewriter
+from database.sql_rewriter import rewrite_sql
+
+
+@pytest.fixture(autouse=True)
+def audit_log(tmp_path, monkeypatch):
+    path = tmp_path / "sql_rewrites.log"
+    monkeypatch.setattr(sql_rewriter, "AUDIT_LOG_PATH", str(path))
+    monkeypatch.setattr(sql_rewriter, "_audit_handler", None)
+    yield path
+    if sql_rewriter._audit_handler is not None:
+        sql_rewriter.logger.removeHandler(sql_rewriter._audit_handler)
+        sql_rewriter._audit_handler.close()
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        # USING reads company_id from the CTE without naming it.
+        "WITH ad AS (SELECT * FROM account_details WHERE company_id = 1) "
+        "SELECT ad.value, c.name FROM ad JOIN companies AS c USING (company_id)",
+        # The CTE alias used as a whole-row value.
+        "WITH ad AS (SELECT * FROM account_details) SELECT TO_JSONB(ad) FROM ad",
+        "WITH ad AS (SELECT * FROM account_details) SELECT ad FROM ad",
+        "WITH ad AS (SELECT * FROM account_details) SELECT value FROM ad",
+        "WITH ad AS (SELECT * FROM account_details) SELECT ad.value FROM ad NATURAL JOIN periods",
+    ],
+)
+def test_star_kept_when_columns_cannot_be_traced(sql):
+    assert rewrite_sql(sql) == sql
+
+
+def test_star_narrowed_to_qualified_columns():
+    sql = "WITH ad AS (SELECT * FROM account_details WHERE company_id = 1) SELECT ad.value, ad.period_id FROM ad"
+    assert rewrite_sql(sql) == (
+        "WITH ad AS (SELECT period_id, value FROM account_details WHERE company_id = 1) "
+        "SELECT ad.value, ad.period_id FROM ad"
+    )
+
+
+def test_year_filter_on_column_made_sargable():
+    assert rewrite_sql("SELECT 1 FROM periods WHERE EXTRACT(YEAR FROM end_date) = 2023") == (
+        "SELECT 1 FROM periods WHERE "
+        "(end_date >= CAST('2023-01-01' AS DATE) AND end_date < CAST('2024-01-01' AS DATE))"
+    )
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT 1 FROM periods WHERE EXTRACT(YEAR FROM AGE(end_date)) = 2",
+        "SELECT 1 FROM periods WHERE EXTRACT(YEAR FROM end_date) = 2023.0",
+        "SELECT 1 FROM periods WHERE EXTRACT(YEAR FROM end_date) = 1e3",
+    ],
+)
+def test_year_filter_left_alone(sql):
+    assert rewrite_sql(sql) == sql
+
+
+def test_rewrites_are_written_to_the_audit_log(audit_log):
+    sql = "SELECT 1 FROM periods WHERE EXTRACT(YEAR FROM end_date) = 2023"
+    rewritten = rewrite_sql(sql)
+    rewrite_sql("SELECT 1")
+
+    records = [json.loads(line) for line in audit_log.read_text().splitlines()]
+    assert records == [{"ts": records[0]["ts"], "rewrites": ["year range"], "before": sql, "after": rewritten}]
@@ -1,17 +1,53 @@
-import json
 
 from django.utils import timezone
 from llama_index.core.tools import FunctionTool
 import datetime
+from database.fiscal_periods import resolve_period
+from database.statements import Statement, execute
 from enums.account_type import AccountType
 from utils import (
     get_acount_details_by_account_number,
+    get_company_index,
     get_db_connection,
     get_period_ids,
+    get_silverfin_store,
+    load_data_preview,
 )
 
 # cursor = conn.cursor()
 
+# Explicit columns: a prepared `SELECT *` breaks on every pooled connection when a column is added.
+ACCOUNT_DETAILS_COLUMNS = (
+    "account_id, company_id, period_id, account_name, account_number, number_without_suffix, "
+    "original_name, original_number, account_type, reconciliation_template_id, value, starred"
+)
+ACCOUNT_DETAILS_BY_COMPANY = Statement(
+    "account_details_by_company",
+    f"SELECT {ACCOUNT_DETAILS_COLUMNS} FROM account_details WHERE account_details.company_id = %(company_id)s",
+)
+ACCOUNT_DETAILS_BY_PERIOD = Statement(
+    "account_details_by_period",
+    f"SELECT {ACCOUNT_DETAILS_COLUMNS} FROM account_details WHERE account_details.period_id = %(period_id)s",
+)
+ACCOUNT_DETAILS_BY_ACCOUNT = Statement(
+    "account_details_by_account",
+    f"SELECT {ACCOUNT_DETAILS_COLUMNS} FROM account_details WHERE account_details.account_id = %(account_id)s",
+)
+RECONCILIATIONS = Statement(
+    "reconciliations_by_period",
+    """SELECT reconciliation_id, name
+       FROM reconciliations
+       WHERE company_id = %(company_id)s AND period_id = %(period_id)s""",
+)
+LIST_TABLES = Statement(
+    "list_tables",
+    "SELECT table_name FROM information_schema.tables WHERE table_schema='public'",
+)
+DESCRIBE_TABLE = Statement(
+    "describe_table",
+    "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %(table_name)s",
+)
+
 
 def multiply(a: float, b: float) -> float:
     """Multiply two numbers and returns the product"""
@@ -23,41 +59,29 @@ def add(a: float, b: float) -> float:
     return a + b
 
 
-def account_api_call(company_id: str, page: int = 1, page_size: int = 100):
+def account_api_call(company_id: str, cursor: int | None = None, page_size: int = 100):
     """
-    Haalt een specifieke pagina van accountdossiers op voor een bedrijf, geïdentificeerd door de company_id.
+    Haalt een pagina accountdossiers op voor een bedrijf, geïdentificeerd door de company_id.
 
     Vereist:
     - company_id (str): Het unieke ID van het bedrijf waarvoor de accounts moeten worden opgehaald.
-    - page (int): De pagina van resultaten die moet worden opgehaald (standaard is pagina 1).
+    - cursor (int): De volgende_cursor uit het vorige antwoord; laat leeg voor de eerste pagina.
     - page_size (int): Het aantal accountdossiers per pagina (standaard is 100).
 
     Retourneert:
-    - Een lijst met accountdossiers voor de opgegeven pagina, of een foutmelding als het bedrijf niet bestaat of geen accounts heeft.
+    - Een dictionary met de accountdossiers van de pagina en de volgende_cursor (None op de laatste pagina),
+      of een foutmelding als het bedrijf niet bestaat of geen accounts heeft.
     """
-    with open("silverfin_api_static_db/accounts.json", "r") as file:
-        accounts = json.load(file)
+    store = get_silverfin_store()
+    if not store.exists("accounts", company_id):
+        return "Geen accounts gevonden voor het opgegeven bedrijf."
 
-    # Get the accounts for the specified company
-    company_accounts = accounts.get(
-        str(company_id), "Geen accounts gevonden voor het opgegeven bedrijf."
-    )
-
-    if isinstance(company_accounts, str):  # If the result is the error message
-        return company_accounts
-
-    # Calculate the start and end indices for pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-
-    # Return the paginated results
-    paginated_accounts = company_accounts[start_index:end_index]
-
-    return (
-        paginated_accounts
-        if paginated_accounts
-        else "Geen meer accounts voor deze pagina."
+    accounts, next_cursor = store.page(
+        "accounts", company_id, after=-1 if cursor is None else cursor, limit=max(1, page_size)
     )
+    if not accounts:
+        return "Geen meer accounts voor deze pagina."
+    return {"accounts": accounts, "volgende_cursor": next_cursor}
 
 
 def company_api_call(company_id: str):
@@ -69,85 +93,59 @@ def company_api_call(company_id: str):
     Retourneert:
     - Een dictionary met bedrijfsinformatie als het bedrijf wordt gevonden, of een foutmelding als het bedrijf niet bestaat.
     """
-    with open("silverfin_api_static_db/companies.json", "r") as file:
-        companies = json.load(file)
-
-    if companies[company_id]:
-        return companies[company_id]
+    company = get_silverfin_store().get("company", company_id)
+    if company:
+        return company
     return "Geen bedrijf gevonden met de opgegeven company_id."
 
 
-def companies_ids_api_call(keywords: list = None):
+def companies_ids_api_call(keywords: list = None, limit: int = 10):
     """
     Geeft de bedrijfs-ids met de overeenkomstige naam terug. Gebruik deze tool wanneer je de company_id niet weet.
+    Zoekt ook bij tikfouten (bv. "Fiduciare" vindt "Fiduciaire").
     Vereist:
-    - keywords: Een lijst met zoekwoorden om te filteren op bedrijfsnamen
+    - keywords: Een lijst met zoekwoorden uit de bedrijfsnaam
+    - limit (int): Het maximaal aantal resultaten (standaard 10).
     Retourneert:
-    - Een lijst met de ids van alle bedrijven voor de opgegeven pagina, gefilterd op zoekwoorden.
+    - Een lijst van (company_id, naam, score) met de best overeenkomende bedrijven eerst; score ligt tussen 0 en 1.
     """
-    companies = """
-        SELECT company_id, name
-        FROM companies
-    """
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(companies)
-            result = cursor.fetchall()
-
-    # Filter results based on keywords
-    if keywords:
-        filtered_result = [
-            (company_id, name)
-            for company_id, name in result
-            if any(keyword.lower() in name.lower() for keyword in keywords)
-        ]
-    else:
-        filtered_result = result
+    if not keywords:
+        return "Geef minstens één zoekwoord uit de bedrijfsnaam op."
 
-    return filtered_result
+    index = get_company_index()
+    index.ensure_fresh()
+    matches = index.search(keywords, limit=max(1, min(int(limit), 100)))
+    if not matches:
+        return f"Geen bedrijven gevonden voor {keywords}."
+    return [(match.company_id, match.name, match.score) for match in matches]
 
 
-def period_api_call(company_id: int, page: int = 1, page_size: int = 100):
+def period_api_call(company_id: int, cursor: int | None = None, page_size: int = 100):
     """
-    Haalt een specifieke pagina van periodes op voor een bedrijf, geïdentificeerd door de company_id.
+    Haalt een pagina periodes op voor een bedrijf, geïdentificeerd door de company_id.
 
     Vereist:
     - company_id (int): Het unieke ID van het bedrijf waarvoor de periodes moeten worden opgehaald.
-    - page (int): De pagina van resultaten die moet worden opgehaald (standaard is pagina 1).
+    - cursor (int): De volgende_cursor uit het vorige antwoord; laat leeg voor de eerste pagina.
     - page_size (int): Het aantal periodes per pagina (standaard is 100).
 
     Retourneert:
-    - Een lijst met periodes die horen bij het opgegeven bedrijf voor de opgegeven pagina.
+    - Een dictionary met de periodes van de pagina en de volgende_cursor (None op de laatste pagina).
     """
-    with open("silverfin_api_static_db/periods.json", "r") as file:
-        periods = json.load(file)
-
-    # Get the periods for the specified company
-    company_periods = periods.get(
-        str(company_id), "Geen periodes gevonden voor het opgegeven bedrijf."
-    )
-
-    if isinstance(company_periods, str):  # If the result is an error message
-        return company_periods
+    store = get_silverfin_store()
+    if not store.exists("periods", company_id):
+        return "Geen periodes gevonden voor het opgegeven bedrijf."
 
-    # Calculate the start and end indices for pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-
-    # Return the paginated results
-    paginated_periods = company_periods[start_index:end_index]
-
-    return (
-        paginated_periods
-        if paginated_periods
-        else "Geen meer periodes voor deze pagina."
+    periods, next_cursor = store.page(
+        "periods", company_id, after=-1 if cursor is None else cursor, limit=max(1, page_size)
     )
+    if not periods:
+        return "Geen meer periodes voor deze pagina."
+    return {"periodes": periods, "volgende_cursor": next_cursor}
 
 
 def company_id_to_name_converter(company_id: int):
-    with open("silverfin_api_static_db/company_ids.json", "r") as file:
-        companies = json.load(file)
-        return companies[str(company_id)]
+    return get_silverfin_store().get("company_name", company_id)
 
 
 def has_tax_decreased_api_call(company_id: int, date: str):
@@ -167,14 +165,14 @@ def has_tax_decreased_api_call(company_id: int, date: str):
     if not date:
         raise ValueError("date is vereist en moet in het 'YYYY-MM-DD'-formaat zijn.")
 
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor: 
             period_id = get_period_ids(cursor, company_id, date)
             if isinstance(period_id, str):
                 return period_id
     return f"""SELECT tax_percentage
               FROM reconciliation_results
-              WHERE company_id = {company_id} and period_id = {period_id}"""
+              WHERE company_id = {int(company_id)} and period_id = {int(period_id)}"""
     # with get_db_connection() as conn:
     #     with conn.cursor() as cursor:
     #         period_id = get_period_ids(cursor, company_id, date)
@@ -212,19 +210,8 @@ def period_id_fetcher(date: str, company_id: int):
     date = timezone.datetime.fromisoformat(date)
     period_ids = f"""
         SELECT period_id
-        FROM periods
-        WHERE company_id = {company_id}
-        AND (
-            end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year}
-            OR
-            end_date = (
-                SELECT MAX(end_date)
-                FROM periods AS p2
-                WHERE p2.company_id = periods.company_id
-                AND DATE_PART('year', p2.end_date) = DATE_PART('year', periods.end_date)
-                AND DATE_PART('year', fiscal_year_end) = {date.year}
-            )
-        );
+        FROM fiscal_periods
+        WHERE company_id = {int(company_id)} AND fiscal_year = {date.year};
     """
     return period_ids
     # with get_db_connection() as conn:
@@ -252,21 +239,18 @@ def account_details(company_id: int = 0, period_id: int = 0, account_id: int = 0
               value en starred. 'Value' vertegenwoordigt de waarde van het account en is belangrijk bij winst/verliesvragen.
     """
 
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
             if company_id != 0:
-                sql = f"""SELECT * FROM account_details WHERE account_details.company_id = {company_id}"""
-                cursor.execute(sql)
+                execute(cursor, ACCOUNT_DETAILS_BY_COMPANY, {"company_id": company_id})
                 return cursor.fetchall()
 
             elif period_id != 0:
-                sql = f"""SELECT * FROM account_details WHERE account_details.period_id = {period_id}"""
-                cursor.execute(sql)
+                execute(cursor, ACCOUNT_DETAILS_BY_PERIOD, {"period_id": period_id})
                 return cursor.fetchall()
 
             elif account_id != 0:
-                sql = f"""SELECT * FROM account_details WHERE account_details.account_id = {account_id}"""
-                cursor.execute(sql)
+                execute(cursor, ACCOUNT_DETAILS_BY_ACCOUNT, {"account_id": account_id})
                 return cursor.fetchall()
 
 
@@ -284,36 +268,14 @@ def reconciliation_api_call(company_id: int, date: str):
 
     """
     date = timezone.datetime.fromisoformat(date)
-    period_ids = f"""
-            SELECT period_id
-            FROM periods
-            WHERE company_id = {company_id} and DATE_PART('year', end_date) = {date.year} and DATE_PART('month', end_date) = {date.month}
-            AND (
-                end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year}
-                OR
-                end_date = (
-                    SELECT MAX(end_date)
-                    FROM periods AS p2
-                    WHERE p2.company_id = periods.company_id
-                    AND DATE_PART('year', p2.end_date) = DATE_PART('year', periods.end_date)
-                    AND DATE_PART('year', fiscal_year_end) = {date.year}
-                )
-            );
-        """
-
-    with get_db_connection() as conn:
+
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(period_ids)
-            period_ids = cursor.fetchall()
-            period_id = period_ids[0][0]
-            print(period_id)
-            sql = f"""SELECT reconciliation_id, name
-                FROM reconciliations
-                WHERE 
-                    company_id = {company_id} AND
-                    period_id = {period_id};
-                """
-            cursor.execute(sql)
+            period = resolve_period(cursor, company_id, date.year)
+            if period is None or period[1].month != date.month:
+                return "Dit bedrijf heeft geen periode tijdens deze datum"
+            period_id = period[0]
+            execute(cursor, RECONCILIATIONS, {"company_id": company_id, "period_id": period_id})
             records = cursor.fetchall()
             return records
 
@@ -324,10 +286,9 @@ def list_tables():
     Returns:
         list: Lijst van tabelnamen in het 'public' schema.
     """
-    sql = "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(sql)
+            execute(cursor, LIST_TABLES)
             result = cursor.fetchall()
     return result
 
@@ -340,10 +301,9 @@ def describe_tables(table_name: str):
     Returns:
         list: Lijst van kolomnamen en hun datatypes voor de opgegeven tabel.
     """
-    sql = f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{table_name}'"
-    with get_db_connection() as conn:
+    with get_db_connection(read_only=True) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(sql)
+            execute(cursor, DESCRIBE_TABLE, {"table_name": table_name})
             result = cursor.fetchall()
     return result
 
@@ -351,15 +311,14 @@ def describe_tables(table_name: str):
 def load_data(sql_query: str):
     """
     Gebruik deze tool enkel als je geen oplossing kan vinden aan de hand van de andere tools. Voert een aangepaste SQL-query uit en retourneert het resultaat.
+    Het resultaat kan groter zijn dan jouw context window dus krijg jij een preview van de data terwijl de volledige data naast jouw antwoord wordt getoond.
     Args:
         sql_query (str): De SQL-query om uit te voeren.
     Returns:
-        list: Resultaten van de uitgevoerde query.
+        str: Een preview van het resultaat, met een melding als het resultaat afgekapt of beperkt werd.
     Opmerking:
         Gebruik eerst de functies list_tables en describe_tables voor context.
+    Foutafhandeling:
+        Geeft een foutbericht terug als de query te duur is volgens de planner of te lang duurt. Herschrijf de query dan goedkoper.
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(sql_query)
-            result = cursor.fetchall()
-    return result
+    return load_data_preview(sql_query)
@@ -1,47 +1,258 @@
-import psycopg2
-import psycopg2._psycopg
+import os
+import time
+
+import psycopg2.extensions
 import streamlit as st
 from django.utils import timezone
 from psycopg2._psycopg import cursor
 
+from database.fiscal_periods import resolve_period
+from database.copy_fetch import fetch_frame
+from database.cost_guard import CostLimits, QueryRejected
+from database.pool import ConnectionPool
+from database.result_cache import ResultCache
+from database.schema_check import check_migrations
+from database.routing import ReplicaRouter, RoutedConnection
+from database.company_index import CompanyNameIndex
+from database.silverfin_store import SilverfinStore
+from database.slow_query_log import SlowQueryLog
+from database.snapshot import AnalyticsSnapshot
+from database.sql_rewriter import rewrite_sql
+from database.statements import Statement, execute
+from database.streaming import StreamBudget, StreamResult
+
+ACCOUNT_VALUES_BY_CLASS = Statement(
+    "account_values_by_class",
+    """SELECT value
+       FROM account_details
+       WHERE company_id = %(company_id)s AND
+             account_class = ANY(%(account_classes)s) AND
+             period_id = %(period_id)s""",
+)
+
+
+def _pool_settings() -> dict:
+    return dict(
+        max_size=int(st.secrets.get("RDS_POOL_MAX_SIZE", 10)),
+        idle_timeout=float(st.secrets.get("RDS_POOL_IDLE_TIMEOUT", 300)),
+        max_lifetime=float(st.secrets.get("RDS_POOL_MAX_LIFETIME", 3600)),
+        checkout_timeout=float(st.secrets.get("RDS_POOL_CHECKOUT_TIMEOUT", 30)),
+    )
+
+
+@st.cache_resource
+def get_connection_pool() -> ConnectionPool:
+    return ConnectionPool(
+        connect_kwargs=dict(
+            database=st.secrets["RDS_NAME"],
+            host=st.secrets["RDS_HOST"],
+            password=st.secrets["RDS_PWD"],
+            port=st.secrets["RDS_PORT"],
+            user=st.secrets["RDS_USER"],
+        ),
+        min_size=int(st.secrets.get("RDS_POOL_MIN_SIZE", 1)),
+        **_pool_settings(),
+    )
+
+
+@st.cache_resource
+def get_router() -> ReplicaRouter:
+    """Routes read-only tools over the RDS_REPLICA_DSNS replicas, everything else to the primary pool."""
+    replicas = {}
+    for dsn in st.secrets.get("RDS_REPLICA_DSNS", []):
+        parsed = psycopg2.extensions.parse_dsn(dsn)
+        name = f"{parsed.get('host', 'localhost')}:{parsed.get('port', 5432)}"
+        # min_size=0 so an unreachable replica doesn't stop the app from starting.
+        replicas[name] = ConnectionPool(connect_kwargs={"dsn": dsn}, min_size=0, **_pool_settings())
+    return ReplicaRouter(
+        get_connection_pool(),
+        replicas,
+        max_lag=float(st.secrets.get("RDS_REPLICA_MAX_LAG", 30)),
+        lag_check_interval=float(st.secrets.get("RDS_REPLICA_LAG_CHECK_INTERVAL", 10)),
+        retry_after=float(st.secrets.get("RDS_REPLICA_RETRY_AFTER", 30)),
+    )
+
+
+def get_db_connection(read_only: bool = False) -> RoutedConnection:
+    """
+    Checks a connection out of the shared pools. Use as `with get_db_connection() as conn:`.
+    Pass read_only=True for tools that only read, so they can be served by a replica.
+    """
+    return get_router().connection(read_only)
+
+
+def get_pool_stats() -> dict:
+    return get_router().stats()
+
+
+def get_stream_budget() -> StreamBudget:
+    return StreamBudget(
+        max_rows=int(st.secrets.get("LOAD_DATA_MAX_ROWS", 100_000)),
+        max_bytes=int(st.secrets.get("LOAD_DATA_MAX_BYTES", 200 * 1024 * 1024)),
+        batch_size=int(st.secrets.get("LOAD_DATA_BATCH_SIZE", 5_000)),
+        copy_threshold=int(st.secrets.get("LOAD_DATA_COPY_THRESHOLD", 50_000)),
+    )
+
+
+def get_cost_limits() -> CostLimits:
+    return CostLimits(
+        max_cost=float(st.secrets.get("LOAD_DATA_MAX_COST", 5_000_000)),
+        max_rows=int(st.secrets.get("LOAD_DATA_MAX_ESTIMATED_ROWS", 10_000_000)),
+        downgrade_cost=float(st.secrets.get("LOAD_DATA_DOWNGRADE_COST", 500_000)),
+        downgrade_rows=int(st.secrets.get("LOAD_DATA_DOWNGRADE_ROWS", 1_000_000)),
+        downgraded_max_rows=int(st.secrets.get("LOAD_DATA_DOWNGRADED_MAX_ROWS", 10_000)),
+        statement_timeout_ms=int(st.secrets.get("LOAD_DATA_STATEMENT_TIMEOUT_MS", 30_000)),
+        downgraded_timeout_ms=int(st.secrets.get("LOAD_DATA_DOWNGRADED_TIMEOUT_MS", 10_000)),
+    )
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    return ResultCache(
+        max_bytes=int(st.secrets.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        ttl=float(st.secrets.get("RESULT_CACHE_TTL", 300)),
+    )
+
+
+def invalidate_cached_results(*tables: str) -> int:
+    """Drops cached load_data results that read from any of `tables`, e.g. after a data refresh."""
+    return get_result_cache().invalidate(*tables)
+
 
-def get_db_connection() -> psycopg2._psycopg.connection:
-    return psycopg2.connect(
-        database=st.secrets["RDS_NAME"],
-        host=st.secrets["RDS_HOST"],
-        password=st.secrets["RDS_PWD"],
-        port=st.secrets["RDS_PORT"],
-        user=st.secrets["RDS_USER"],
+@st.cache_resource
+def get_slow_query_log() -> SlowQueryLog:
+    return SlowQueryLog(
+        lambda: get_db_connection(read_only=True),
+        threshold=float(st.secrets.get("SLOW_QUERY_THRESHOLD", 2.0)),
+        path=st.secrets.get("SLOW_QUERY_LOG_PATH", "logs/slow_queries.log"),
+        max_bytes=int(st.secrets.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(st.secrets.get("SLOW_QUERY_LOG_BACKUPS", 5)),
+    )
+
+
+@st.cache_resource
+def get_company_index() -> CompanyNameIndex:
+    return CompanyNameIndex(
+        lambda: get_db_connection(read_only=True),
+        refresh_interval=float(st.secrets.get("COMPANY_INDEX_REFRESH_INTERVAL", 60)),
+        full_refresh_interval=float(st.secrets.get("COMPANY_INDEX_FULL_REFRESH_INTERVAL", 3600)),
+    )
+
+
+@st.cache_resource
+def get_silverfin_store() -> SilverfinStore:
+    source_dir = st.secrets.get("SILVERFIN_STATIC_DIR", "silverfin_api_static_db")
+    return SilverfinStore(
+        source_dir,
+        st.secrets.get("SILVERFIN_STORE_PATH", os.path.join(source_dir, "store.sqlite")),
+        check_interval=float(st.secrets.get("SILVERFIN_STORE_CHECK_INTERVAL", 30)),
+    )
+
+
+@st.cache_resource
+def check_schema() -> bool:
+    """
+    Raises MissingMigration when the account_class or fiscal_periods migration has not been run.
+    Only a passing check is cached, so the app picks up a migration on the next rerun.
+    """
+    with get_db_connection(read_only=True) as conn:
+        with conn.cursor() as cursor:
+            check_migrations(cursor)
+    return True
+
+
+def fetch_cached(sql_query: str, params: dict | None = None, on_batch=None) -> StreamResult:
+    """
+    fetch_frame behind the shared result cache, so identical questions across sessions hit RDS once.
+    Raises QueryRejected when the cost guard refuses the query.
+    """
+    budget = get_stream_budget()
+    sql_query = rewrite_sql(sql_query, limit=budget.max_rows + 1)
+    cache = get_result_cache()
+    result = cache.get(sql_query, params)
+    if result is None:
+        start = time.perf_counter()
+        with get_db_connection(read_only=True) as conn:
+            result = fetch_frame(
+                conn,
+                sql_query,
+                params,
+                budget=budget,
+                on_batch=on_batch,
+                limits=get_cost_limits(),
+            )
+        get_slow_query_log().observe(sql_query, params, time.perf_counter() - start, "load_data")
+        cache.put(sql_query, params, result)
+    elif on_batch is not None:
+        on_batch(result.frame)
+    return result
+
+
+def show_partial_data(frame):
+    """Fills the data pane next to the chat while load_data is still streaming rows in."""
+    placeholder = st.session_state.get("data_placeholder")
+    if placeholder is not None:
+        placeholder.dataframe(frame, use_container_width=True, height=500)
+
+
+def truncation_notice(result: StreamResult) -> str:
+    if result.notice:
+        return result.notice
+    if not result.truncated:
+        return ""
+    return (
+        f"\nLet op: het resultaat is afgekapt na {result.rows} rijen omdat de limiet bereikt is. "
+        "Verfijn de query (WHERE, LIMIT of aggregatie) als de volledige data nodig is."
+    )
+
+
+PREVIEW_BERICHT = "Het volgende is een preview van data, de user krijgt de hele data te zien. Jij, de chatbot krijgt een deel omdat er anders het risico is om jou context window te overflowen. Vermeld in je antwoord dat jij een preview hebt van de data en de volledige data rechts van de chat te vinden is!"
+
+
+def load_data_preview(sql_query: str, params: dict | None = None) -> str:
+    """
+    Shared body of the load_data tools: runs the query through fetch_cached, shows the full
+    result next to the chat and returns the agent a one-row preview plus the truncation or
+    cost-guard notice, or the QueryRejected message.
+    """
+    try:
+        result = fetch_cached(sql_query, params, on_batch=show_partial_data)
+    except QueryRejected as e:
+        return str(e)
+    st.session_state.data = result.frame
+    return PREVIEW_BERICHT + str(result.preview.head(1)) + truncation_notice(result)
+
+
+def get_fresh_snapshot(fiscal_years) -> AnalyticsSnapshot | None:
+    """
+    The Parquet snapshot in SNAPSHOT_DIR if it is younger than SNAPSHOT_MAX_AGE_HOURS and
+    covers all `fiscal_years`, else None.
+    """
+    snapshot = AnalyticsSnapshot.open(st.secrets.get("SNAPSHOT_DIR"))
+    max_age = float(st.secrets.get("SNAPSHOT_MAX_AGE_HOURS", 24)) * 3600
+    if snapshot is None or not snapshot.is_fresh(max_age) or not snapshot.covers(fiscal_years):
+        return None
+    return snapshot
+
+
+def snapshot_notice(snapshot: AnalyticsSnapshot) -> str:
+    return (
+        f"\nBron: analytische snapshot van {snapshot.created_at:%Y-%m-%d %H:%M} UTC "
+        f"({snapshot.age_seconds() / 3600:.0f} uur oud). Recentere boekingen zijn mogelijk nog niet meegenomen; "
+        "vermeld dit in je antwoord."
     )
 
 
 def get_period_ids(cursor: cursor, company_id: int, date: str):
     try:
         date = timezone.datetime.fromisoformat(date)
-        period_ids_query = f"""
-            SELECT period_id
-            FROM periods
-            WHERE company_id = {company_id}
-            AND (
-                end_date = fiscal_year_end AND DATE_PART('year', fiscal_year_end) = {date.year}
-                OR
-                end_date = (
-                    SELECT MAX(end_date)
-                    FROM periods AS p2
-                    WHERE p2.company_id = periods.company_id
-                    AND DATE_PART('year', p2.end_date) = DATE_PART('year', periods.end_date)
-                    AND DATE_PART('year', fiscal_year_end) = {date.year}
-                )
-            );
-        """
-        cursor.execute(period_ids_query)
-        period_ids = cursor.fetchall()
+        period = resolve_period(cursor, company_id, date.year)
 
         # Logical check if no period is found
-        if len(period_ids) == 0:
+        if period is None:
             return "Dit bedrijf heeft geen periode tijdens deze datum"
 
-        return period_ids[0][0]
+        return period[0]
 
     except Exception as e:
         # Handle exceptions like database connectivity issues, SQL errors, etc.
@@ -51,17 +262,11 @@ def get_period_ids(cursor: cursor, company_id: int, date: str):
 def get_acount_details_by_account_number(
     cursor: cursor, company_id: int, period_id: int, number_filter: list[int]
 ):
-
-    number_filter_str = "%|".join([str(i) for i in number_filter])
-    number_filter_str += "%"
-    print(number_filter_str)
-    sql = f"""SELECT value
-                FROM account_details
-                WHERE 
-                    company_id = {company_id} AND
-                    account_number SIMILAR TO '{number_filter_str}' AND
-                    period_id = {period_id};
-                """
-    cursor.execute(sql)
+    params = {
+        "company_id": company_id,
+        "period_id": period_id,
+        "account_classes": [int(i) for i in number_filter],
+    }
+    execute(cursor, ACCOUNT_VALUES_BY_CLASS, params)
     records = cursor.fetchall()
     return records